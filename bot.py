@@ -2,11 +2,25 @@ import logging
 import os
 import re
 import asyncio
-import time
-from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
+import functools
+import hashlib
+import pathlib
+from telegram import (
+    Update,
+    BotCommand,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputFile,
+    InputMediaPhoto,
+    InputMediaVideo,
+)
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, filters, Application
 from dotenv import load_dotenv
 
+# Load environment variables (before importing modules that read their settings at import time)
+basedir = os.path.abspath(os.path.dirname(__file__))
+load_dotenv(os.path.join(basedir, '.env'))
+
 # تعطيل رسائل السجلات الخاصة بمكتبة الاتصال httpx
 logging.getLogger("httpx").setLevel(logging.WARNING)
 # Import downloaders
@@ -15,22 +29,164 @@ from downloaders import (
     download_twitter_video,
     download_facebook_video,
     download_tiktok_video,
-    is_tiktok_url,
     check_file_size,
     cleanup_file,
-    MAX_FILE_SIZE_MB
+    detect_platform,
+    get_media_key,
+    probe_media,
+    DownloadCancelled,
+    MAX_FILE_SIZE_MB,
+    BOT_API_LOCAL_MODE_ENABLED
 )
 
 from downloaders.instagram import get_post_media, InstagramMedia
+from file_cache import FileIdCache, CachedFile
+from scheduler import JobScheduler, QueueFullError, PLATFORMS, FAST_LANE, BULK_LANE
+from singleflight import SingleFlight
+from progress import ProgressService, StatusMessage, render_encode_progress
+from flood_control import FloodControl
+from watermark import WatermarkPool, WatermarkQueueFull
+from storage import DownloadStorage, StorageFullError
+from update_processor import ChatOrderedUpdateProcessor
+from http_pools import MeteredHTTPXRequest, RoutingRequest, pool_stats
+from cancellation import CancelRegistry, CancelScope
+from streaming import VideoAttributes, prepare_for_streaming
+from user_limits import UserLimiter, UserQueueFull, UserRateLimited
 
-# Load environment variables
-basedir = os.path.abspath(os.path.dirname(__file__))
-load_dotenv(os.path.join(basedir, '.env'))
 TOKEN = os.getenv("BOT_TOKEN")
 if TOKEN:
     TOKEN = TOKEN.strip()
 WATERMARK_ENABLED = os.getenv("WATERMARK_ENABLED", "False").lower() == "true"
 WATERMARK_TEXT = os.getenv("WATERMARK_TEXT", "@your_channel_name")
+# Watermarking runs in its own worker processes so it never blocks the event loop
+WATERMARK_POOL = WatermarkPool(
+    workers=int(os.getenv("WATERMARK_WORKERS", "0")) or None,
+    max_queued=int(os.getenv("WATERMARK_MAX_QUEUED", "20")),
+    timeout=float(os.getenv("WATERMARK_TIMEOUT", "600")),
+)
+# Faststart remux, keyframe thumbnail and dimensions/duration for uploaded videos
+STREAMING_PREP_ENABLED = os.getenv("VIDEO_STREAMING_PREP", "True").lower() == "true"
+
+# Telegram accepts at most 10 items per media group (album)
+MEDIA_GROUP_LIMIT = 10
+
+# Progress updates share a bot-wide edit budget so they never crowd out real replies
+PROGRESS = ProgressService(
+    edits_per_second=float(os.getenv("PROGRESS_EDITS_PER_SECOND", "5")),
+    min_interval=float(os.getenv("PROGRESS_MIN_INTERVAL", "2")),
+)
+
+# Outbound flood control: bot-wide and per-chat send budgets (Telegram: ~30 msg/s, 1/s per chat, 20/min per group)
+FLOOD_CONTROL = FloodControl(
+    overall_rate=float(os.getenv("FLOOD_GLOBAL_RATE", "30")),
+    chat_rate=float(os.getenv("FLOOD_CHAT_RATE", "1")),
+    group_rate=float(os.getenv("FLOOD_GROUP_RATE_PER_MINUTE", "20")) / 60,
+    chat_burst=float(os.getenv("FLOOD_CHAT_BURST", "3")),
+    max_retries=int(os.getenv("FLOOD_MAX_RETRIES", "3")),
+)
+
+# Bot API endpoint (defaults to api.telegram.org); point at fake_bot_api.py for local testing
+BOT_API_URL = os.getenv("BOT_API_URL", "").strip().rstrip("/")
+# Local Bot API server (telegram-bot-api --local): files are passed by path instead of uploaded
+BOT_API_LOCAL_MODE = BOT_API_LOCAL_MODE_ENABLED and bool(BOT_API_URL)
+# Where the Bot API server sees our downloads directory, if it mounts it at a different path
+BOT_API_DOWNLOADS_PATH = os.getenv("BOT_API_DOWNLOADS_PATH", "").strip()
+
+# Webhook mode: enabled when WEBHOOK_URL is set, otherwise the bot uses long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBHOOK_DELETE_ON_EXIT = os.getenv("WEBHOOK_DELETE_ON_EXIT", "True").lower() == "true"
+
+# Telegram file_id cache: repeat links are answered without downloading or uploading again
+FILE_ID_CACHE = FileIdCache(
+    os.getenv("FILE_ID_CACHE_PATH", os.path.join(basedir, "file_id_cache.json")),
+    ttl_seconds=float(os.getenv("FILE_ID_CACHE_TTL_HOURS", "720")) * 3600,
+    max_entries=int(os.getenv("FILE_ID_CACHE_MAX_ENTRIES", "10000")),
+)
+
+# Downloads directory: per-job working dirs, a byte quota with LRU eviction of orphans, periodic sweeps
+STORAGE = DownloadStorage(
+    root=os.getenv("DOWNLOADS_DIR", "downloads"),
+    quota_bytes=int(os.getenv("DOWNLOADS_QUOTA_MB", "4096")) * 1024 * 1024,
+    max_file_bytes=MAX_FILE_SIZE_MB * 1024 * 1024,
+    tmpfs_root=os.getenv("DOWNLOADS_TMPFS_PATH", "").strip() or None,
+    tmpfs_max_file_bytes=int(os.getenv("DOWNLOADS_TMPFS_MAX_FILE_MB", "50")) * 1024 * 1024,
+    orphan_age=float(os.getenv("DOWNLOADS_ORPHAN_AGE", "600")),
+    sweep_interval=float(os.getenv("DOWNLOADS_SWEEP_INTERVAL", "600")),
+)
+
+# Job scheduling: per-platform download slots and a bounded wait queue
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "2"))
+PROBE_WORKERS = max(1, int(os.getenv("LANE_PROBE_WORKERS", "2")))
+SCHEDULER = JobScheduler(
+    platform_limits={
+        platform: int(os.getenv(f"MAX_CONCURRENT_{platform.upper()}", str(MAX_CONCURRENT_DOWNLOADS)))
+        for platform in PLATFORMS
+    },
+    max_queued=int(os.getenv("MAX_QUEUED_JOBS", "50")),
+    stage_workers={
+        "resolve": int(os.getenv("RESOLVE_WORKERS", "4")),
+        "probe": PROBE_WORKERS,
+        "postprocess": int(os.getenv("POSTPROCESS_WORKERS", "2")),
+    },
+    upload_limit=int(os.getenv("UPLOAD_WORKERS", "4")),
+    default_limit=MAX_CONCURRENT_DOWNLOADS,
+    # Small jobs get a fast lane so a queue of long videos cannot hold them up
+    fast_reserved=int(os.getenv("FAST_LANE_RESERVED", "1")),
+    aging_seconds=float(os.getenv("LANE_AGING_SECONDS", "120")),
+    fast_max_bytes=int(os.getenv("FAST_LANE_MAX_MB", "20")) * 1024 * 1024,
+    fast_max_seconds=float(os.getenv("FAST_LANE_MAX_SECONDS", "180")),
+)
+LANE_PROBE_TIMEOUT = float(os.getenv("LANE_PROBE_TIMEOUT", "15"))
+# Held until a probe's extraction really ends, even after we stopped waiting for it
+PROBE_SLOTS = asyncio.Semaphore(PROBE_WORKERS)
+
+# Inbound limits per user: links per minute, pending jobs, and an admin allowlist exempt from both
+USER_LIMITS = UserLimiter(
+    rate_per_minute=float(os.getenv("USER_LINKS_PER_MINUTE", "10")),
+    burst=float(os.getenv("USER_LINK_BURST", "5")),
+    max_pending=int(os.getenv("USER_MAX_PENDING_JOBS", "3")),
+    admins=[int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if user_id],
+    admin_weight=float(os.getenv("ADMIN_QUEUE_WEIGHT", "2")),
+)
+
+# Jobs that can be stopped with the Cancel button on their status message
+CANCELLATIONS = CancelRegistry()
+
+# Updates of different chats are handled concurrently; each chat's updates stay in order
+UPDATE_PROCESSOR = ChatOrderedUpdateProcessor(
+    max_concurrent_updates=int(os.getenv("MAX_CONCURRENT_UPDATES", "32")),
+)
+
+# Separate HTTP connection pools: polling, quick control calls (edits, answers) and media uploads
+HTTP_UPLOAD_TIMEOUT = float(os.getenv("HTTP_UPLOAD_TIMEOUT", "300"))
+HTTP_UPDATES = MeteredHTTPXRequest(
+    "updates",
+    connection_pool_size=1,
+    read_timeout=30,
+    write_timeout=30,
+    connect_timeout=15,
+    pool_timeout=30,
+)
+HTTP_CONTROL = MeteredHTTPXRequest(
+    "control",
+    connection_pool_size=int(os.getenv("HTTP_CONTROL_POOL_SIZE", "32")),
+    read_timeout=float(os.getenv("HTTP_CONTROL_TIMEOUT", "30")),
+    write_timeout=float(os.getenv("HTTP_CONTROL_TIMEOUT", "30")),
+    connect_timeout=15,
+    pool_timeout=10,
+)
+HTTP_UPLOADS = MeteredHTTPXRequest(
+    "uploads",
+    connection_pool_size=int(os.getenv("HTTP_UPLOAD_POOL_SIZE", "8")),
+    read_timeout=HTTP_UPLOAD_TIMEOUT,
+    write_timeout=HTTP_UPLOAD_TIMEOUT,
+    media_write_timeout=HTTP_UPLOAD_TIMEOUT,
+    connect_timeout=15,
+    pool_timeout=HTTP_UPLOAD_TIMEOUT,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -49,12 +205,195 @@ def build_buttons(media_list: list[InstagramMedia]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(keyboard)
 
 
-async def _send_instagram_media(chat_message, media: InstagramMedia):
+def build_cancel_button(scope: CancelScope) -> InlineKeyboardMarkup:
+    """Cancel button for a job's status message."""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✖️ إلغاء | Cancel", callback_data=f"cancel:{scope.job_id}")]])
+
+
+def _cache_key(media_key: str, watermarked: bool = False) -> str:
+    """Watermarked uploads differ from the originals, so they are cached separately."""
+    if watermarked and WATERMARK_ENABLED:
+        return f"{media_key}|wm:{WATERMARK_TEXT}"
+    return media_key
+
+
+def _extract_file_id(sent_message) -> tuple[str, str] | None:
+    """Returns (kind, file_id) for the media Telegram stored for a sent message."""
+    if sent_message is None:
+        return None
+    if sent_message.video:
+        return "video", sent_message.video.file_id
+    if sent_message.photo:
+        return "photo", sent_message.photo[-1].file_id
+    if sent_message.audio:
+        return "audio", sent_message.audio.file_id
+    if sent_message.document:
+        return "document", sent_message.document.file_id
+    return None
+
+
+def _remember_file_id(cache_key: str | None, sent_message):
+    if not cache_key:
+        return
+    extracted = _extract_file_id(sent_message)
+    if extracted:
+        FILE_ID_CACHE.put(cache_key, *extracted)
+
+
+async def _send_cached(chat_message, cache_key: str) -> bool:
+    """Resends a previously uploaded file by file_id. Returns False on a cache miss."""
+    cached: CachedFile | None = FILE_ID_CACHE.get(cache_key)
+    if cached is None:
+        return False
+    try:
+        if cached.kind == "video":
+            await chat_message.reply_video(video=cached.file_id)
+        elif cached.kind == "photo":
+            await chat_message.reply_photo(photo=cached.file_id)
+        elif cached.kind == "audio":
+            await chat_message.reply_audio(audio=cached.file_id)
+        else:
+            await chat_message.reply_document(document=cached.file_id)
+    except Exception as e:
+        logger.warning(f"Cached file_id for {cache_key} was rejected: {e}")
+        FILE_ID_CACHE.invalidate(cache_key)
+        return False
+    logger.info(f"Served {cache_key} from file_id cache ({FILE_ID_CACHE.stats()})")
+    return True
+
+
+async def _send_instagram_media(chat_message, media: InstagramMedia, cache_key: str | None = None):
     """Send a single Instagram media item using direct URL."""
+    if cache_key and await _send_cached(chat_message, cache_key):
+        return
     if media.kind == "video":
-        await chat_message.reply_video(video=media.url, write_timeout=300, read_timeout=300)
+        sent = await chat_message.reply_video(video=media.url, write_timeout=300, read_timeout=300)
     else:
-        await chat_message.reply_photo(photo=media.url, write_timeout=300, read_timeout=300)
+        sent = await chat_message.reply_photo(photo=media.url, write_timeout=300, read_timeout=300)
+    _remember_file_id(cache_key, sent)
+
+
+def _video_kwargs(attributes: VideoAttributes | None) -> dict:
+    """reply_video arguments that let clients show and stream a video before it is fully downloaded."""
+    if attributes is None:
+        return {}
+    kwargs = {"supports_streaming": True}
+    if attributes.width and attributes.height:
+        kwargs.update(width=attributes.width, height=attributes.height)
+    if attributes.duration:
+        kwargs["duration"] = round(attributes.duration)
+    if attributes.thumbnail and os.path.exists(attributes.thumbnail):
+        # Thumbnails are always uploaded (never a file_id or path); they are only a few KB.
+        with open(attributes.thumbnail, 'rb') as f:
+            kwargs["thumbnail"] = InputFile(f.read(), filename=os.path.basename(attributes.thumbnail))
+    return kwargs
+
+
+async def _reply_with_media(chat_message, file_path: str, media, attributes: VideoAttributes | None = None):
+    """Sends ``media`` with the reply method matching the extension of ``file_path``."""
+    if file_path.endswith(('.jpg', '.jpeg', '.png')):
+        return await chat_message.reply_photo(photo=media, write_timeout=300, read_timeout=300)
+    elif file_path.endswith(('.mp4', '.mkv', '.avi')):
+        return await chat_message.reply_video(
+            video=media, write_timeout=300, read_timeout=300, **_video_kwargs(attributes)
+        )
+    elif file_path.endswith(('.mp3', '.m4a', '.wav', '.flac')):
+        return await chat_message.reply_audio(audio=media, write_timeout=300, read_timeout=300)
+    else:
+        return await chat_message.reply_document(document=media, write_timeout=300, read_timeout=300)
+
+
+def _local_file_uri(file_path: str) -> str:
+    """file:// URI under which a local Bot API server can read one of our downloads."""
+    path = os.path.abspath(file_path)
+    if BOT_API_DOWNLOADS_PATH:
+        downloads_dir = STORAGE.root
+        if os.path.commonpath([path, downloads_dir]) == downloads_dir:
+            path = os.path.join(BOT_API_DOWNLOADS_PATH, os.path.relpath(path, downloads_dir))
+    return pathlib.Path(path).as_uri()
+
+
+async def _send_file(chat_message, file_path: str, attributes: VideoAttributes | None = None):
+    """
+    Uploads a local file with the reply method matching its extension.
+    Videos are sent with ``attributes`` (dimensions, duration, thumbnail).
+
+    Against a local Bot API server only the file's path is sent and the server
+    reads it from the shared disk. Otherwise the file handle is passed through
+    to httpx unread, which streams the multipart body from disk in fixed-size
+    chunks instead of loading the whole file into memory; the handle is closed
+    as soon as the call returns.
+    """
+    if BOT_API_LOCAL_MODE:
+        return await _reply_with_media(chat_message, file_path, _local_file_uri(file_path), attributes)
+    with open(file_path, 'rb') as f:
+        media = InputFile(f, filename=os.path.basename(file_path), read_file_handle=False)
+        return await _reply_with_media(chat_message, file_path, media, attributes)
+
+
+def _carousel_key(media_key: str | None, index: int) -> str | None:
+    return f"{media_key}:{index}" if media_key else None
+
+
+def _album_chunks(items: list, limit: int = MEDIA_GROUP_LIMIT) -> list[list]:
+    """Splits items into the fewest albums of at most ``limit``, balanced so none ends up with a lone item."""
+    if not items:
+        return []
+    count = -(-len(items) // limit)
+    size, extra = divmod(len(items), count)
+    chunks, start = [], 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def _album_input(media: InstagramMedia, cache_key: str | None):
+    """InputMedia for one carousel item, reusing a cached file_id when we have one."""
+    cached = FILE_ID_CACHE.get(cache_key) if cache_key else None
+    if cached is not None and cached.kind in ("photo", "video"):
+        source, kind = cached.file_id, cached.kind
+    else:
+        source, kind = media.url, media.kind
+    if kind == "video":
+        return InputMediaVideo(media=source)
+    return InputMediaPhoto(media=source)
+
+
+async def _send_album_chunk(chat_message, chunk: list[tuple[int, InstagramMedia]], media_key: str | None):
+    if len(chunk) == 1:
+        index, media = chunk[0]
+        await _send_instagram_media(chat_message, media, _carousel_key(media_key, index))
+        return
+
+    keys = [_carousel_key(media_key, index) for index, _ in chunk]
+    try:
+        sent_messages = await chat_message.reply_media_group(
+            media=[_album_input(media, key) for (_, media), key in zip(chunk, keys)],
+            write_timeout=300,
+            read_timeout=300,
+        )
+    except Exception as e:
+        # One bad item (or a stale file_id) fails the whole album; fall back to single sends.
+        logger.warning(f"Sending album failed: {e}. Sending items one by one.")
+        for key in keys:
+            if key:
+                FILE_ID_CACHE.invalidate(key)
+        for (index, media), key in zip(chunk, keys):
+            await _send_instagram_media(chat_message, media, key)
+        return
+
+    for key, sent in zip(keys, sent_messages):
+        _remember_file_id(key, sent)
+
+
+async def _send_instagram_albums(chat_message, media_list: list[InstagramMedia], media_key: str | None):
+    """Sends a whole carousel as media groups of up to 10 mixed photos/videos, in carousel order."""
+    # One album at a time: concurrent albums may arrive out of order, and the
+    # chat's flood-control bucket would serialize them anyway.
+    for chunk in _album_chunks(list(enumerate(media_list))):
+        await _send_album_chunk(chat_message, chunk, media_key)
 
 
 async def handle_selection(callback_query, context: ContextTypes.DEFAULT_TYPE):
@@ -68,6 +407,7 @@ async def handle_selection(callback_query, context: ContextTypes.DEFAULT_TYPE):
     selection = data.split(":", 1)[1]
 
     media_list = context.user_data.get("ig_media_list")
+    media_key = context.user_data.get("ig_media_key")
     if not media_list:
         await callback_query.message.reply_text("❌ انتهت صلاحية الاختيار. أرسل الرابط مرة أخرى.\n❌ Selection expired. Please send the link again.")
         return
@@ -75,8 +415,7 @@ async def handle_selection(callback_query, context: ContextTypes.DEFAULT_TYPE):
     try:
         if selection == "all":
             await callback_query.message.reply_text("⬆️ Sending all media...")
-            for media in media_list:
-                await _send_instagram_media(callback_query.message, media)
+            await _send_instagram_albums(callback_query.message, media_list, media_key)
         else:
             try:
                 index = int(selection)
@@ -88,7 +427,7 @@ async def handle_selection(callback_query, context: ContextTypes.DEFAULT_TYPE):
                 await callback_query.message.reply_text("❌ رقم غير صالح | Invalid index")
                 return
 
-            await _send_instagram_media(callback_query.message, media_list[index])
+            await _send_instagram_media(callback_query.message, media_list[index], _carousel_key(media_key, index))
 
         # Remove buttons after successful selection to avoid confusion
         try:
@@ -98,12 +437,17 @@ async def handle_selection(callback_query, context: ContextTypes.DEFAULT_TYPE):
     finally:
         # Clear selection state
         context.user_data.pop("ig_media_list", None)
+        context.user_data.pop("ig_media_key", None)
 
 
 async def instagram_selection_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """PTB handler wrapper for Instagram selection callbacks."""
     if not update.callback_query:
         return
+    pending = context.user_data.get("ig_pending")
+    if pending is not None and not pending.done():
+        # The user's latest link may still be resolving into ig_media_list.
+        await asyncio.wait([pending])
     await handle_selection(update.callback_query, context)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -247,6 +591,20 @@ async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sends load and limit counters to admins."""
+    if not USER_LIMITS.is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ هذا الأمر للمشرفين فقط | This command is for admins only")
+        return
+    await update.message.reply_text(
+        "📊 Stats\n\n"
+        f"Jobs: {SCHEDULER.stats()}\n"
+        f"Users: {USER_LIMITS.stats()}\n"
+        f"Downloads in flight: {len(INFLIGHT)}\n"
+        f"File cache: {FILE_ID_CACHE.stats()}\n"
+        f"HTTP pools: {pool_stats(HTTP_UPDATES, HTTP_CONTROL, HTTP_UPLOADS)}"
+    )
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles button clicks."""
     query = update.callback_query
@@ -437,141 +795,329 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Please send a valid URL starting with http:// or https://")
         return
 
-    status_msg = await update.message.reply_text("⏳ جاري معالجة الرابط... | Processing your link...")
-    
-    # Progress callback setup
-    loop = asyncio.get_running_loop()
-    last_update_time = 0
+    media_key = get_media_key(url)
+    if await _send_cached(update.message, _cache_key(media_key, watermarked=not media_key.startswith("instagram:"))):
+        return
 
-    def progress_callback(downloaded, total):
-        nonlocal last_update_time
-        current_time = time.time()
-        
-        # Update every 2 seconds or if completed
-        if current_time - last_update_time < 2 and downloaded < total:
-            return
-            
-        last_update_time = current_time
-        if total > 0:
-            percentage = (downloaded / total) * 100
-            bar_length = 15
-            filled_length = int(bar_length * downloaded // total)
-            bar = '█' * filled_length + '░' * (bar_length - filled_length)
-            text = f"⬇️ جاري التحميل... | Downloading...\n[{bar}] {percentage:.1f}%"
-        else:
-            text = "⬇️ جاري التحميل... | Downloading..."
+    platform = detect_platform(url)
+    if platform is None:
+        await update.message.reply_text("❌ رابط غير مدعوم. أدعم YouTube, Instagram, Twitter, Facebook, و TikTok.\n❌ Unsupported URL. I support YouTube, Instagram, Twitter, Facebook, and TikTok.")
+        return
 
-        try:
-            asyncio.run_coroutine_threadsafe(
-                status_msg.edit_text(text),
-                loop
-            )
-        except Exception:
-            pass # Ignore errors if message is not modified or network issues
+    user_id = update.effective_user.id
+    try:
+        USER_LIMITS.acquire(user_id)
+    except UserRateLimited as e:
+        wait = max(1, round(e.retry_after))
+        await update.message.reply_text(f"🐢 أرسلت روابط كتير بسرعة، حاول بعد {wait} ثانية.\n🐢 You are sending links too fast, try again in {wait}s.")
+        return
+    except UserQueueFull as e:
+        await update.message.reply_text(f"🚦 عندك {e.pending} طلبات شغالة بالفعل، استنى لما يخلصوا.\n🚦 You already have {e.pending} downloads in progress, please wait for them to finish.")
+        return
 
+    scope = None
+    reply_markup = None
     try:
-        files_to_send = []
-        
-        # Route based on URL domain
-        if "youtube.com" in url or "youtu.be" in url:
-            await status_msg.edit_text("⬇️ جاري التحميل من YouTube... | Downloading from YouTube...")
-            file_path = await asyncio.to_thread(download_youtube_video, url, "downloads", progress_callback)
-            files_to_send.append(file_path)
-            
-        elif "instagram.com" in url:
-            await status_msg.edit_text("🔎 جاري جلب بيانات المنشور من Instagram... | Fetching Instagram post info...")
-            media_list = await asyncio.to_thread(get_post_media, url)
-
-            if not media_list:
-                raise Exception("Empty media list")
-
-            # Carousel: show buttons; Non-carousel: send immediately.
-            if len(media_list) == 1:
-                await status_msg.delete()
-                await _send_instagram_media(update.message, media_list[0])
-                return
+        if platform != "instagram":
+            scope = CANCELLATIONS.open(user_id)
+            reply_markup = build_cancel_button(scope)
+        status_msg = StatusMessage(
+            await update.message.reply_text("⏳ جاري معالجة الرابط... | Processing your link...", reply_markup=reply_markup),
+            reply_markup,
+        )
+    except BaseException:
+        if scope is not None:
+            CANCELLATIONS.close(scope)
+        USER_LIMITS.release(user_id)
+        raise
 
-            context.user_data["ig_media_list"] = media_list
-            await status_msg.delete()
-            await update.message.reply_text(
-                "Choose an image number:",
-                reply_markup=build_buttons(media_list),
-            )
-            return
-            
-        elif "twitter.com" in url or "x.com" in url:
-            # await status_msg.edit_text("📥 Downloading from Twitter/X...")
-            file_path = await asyncio.to_thread(download_twitter_video, url, "downloads", progress_callback)
-            files_to_send.append(file_path)
-            
-        elif "facebook.com" in url or "fb.watch" in url:
-            # await status_msg.edit_text("📥 Downloading from Facebook...")
-            file_path = await asyncio.to_thread(download_facebook_video, url, "downloads", progress_callback)
-            files_to_send.append(file_path)
-
-        elif is_tiktok_url(url):
-            await status_msg.edit_text("⬇️ جاري التحميل من TikTok... | Downloading from TikTok...")
-            file_path = await asyncio.to_thread(download_tiktok_video, url, "downloads", progress_callback)
-            files_to_send.append(file_path)
-            
-        else:
-            await status_msg.edit_text("❌ رابط غير مدعوم. أدعم YouTube, Instagram, Twitter, Facebook, و TikTok.\n❌ Unsupported URL. I support YouTube, Instagram, Twitter, Facebook, and TikTok.")
+    # Jobs run detached so the chat's next updates are not held up; each releases the user's admission when it ends.
+    if platform == "instagram":
+        # A user's Instagram links are resolved one after another, and carousel choices wait for them
+        # (see instagram_selection_callback), so a choice never races the link it belongs to.
+        previous = context.user_data.get("ig_pending")
+        job = _run_link_job(update, context, url, platform, media_key, status_msg, after=previous)
+        task = context.application.create_task(job, update=update)
+        context.user_data["ig_pending"] = task
+        task.add_done_callback(functools.partial(_forget_pending, context.user_data))
+    else:
+        scope.task = context.application.create_task(
+            _run_link_job(update, context, url, platform, media_key, status_msg, scope), update=update
+        )
+
+
+def _forget_pending(user_data: dict, task: asyncio.Task):
+    if user_data.get("ig_pending") is task:
+        del user_data["ig_pending"]
+
+
+async def cancel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancels the job behind a status message's Cancel button."""
+    query = update.callback_query
+    scope = CANCELLATIONS.get(query.data.split(":", 1)[1])
+    if scope is None:
+        await query.answer("انتهت هذه المهمة بالفعل | This job has already finished")
+        return
+    if scope.owner_id != query.from_user.id:
+        await query.answer("⛔ فقط من أرسل الرابط يمكنه الإلغاء | Only the sender can cancel this")
+        return
+    if scope.cancel():
+        await query.answer("🛑 جاري الإلغاء... | Cancelling...")
+    elif scope.cancelled:
+        await query.answer("🛑 الإلغاء قيد التنفيذ بالفعل | Already cancelling")
+    elif scope.task is None:
+        await query.answer("⏳ المهمة لم تبدأ بعد، حاول مرة أخرى | The job has not started yet, try again")
+    else:
+        await query.answer("انتهت هذه المهمة بالفعل | This job has already finished")
+
+
+async def _run_link_job(update: Update, context: ContextTypes.DEFAULT_TYPE, url, platform, media_key,
+                        status_msg: StatusMessage, scope: CancelScope | None = None,
+                        after: asyncio.Task | None = None):
+    """
+    Downloads, prepares and uploads the media behind a link, reporting
+    failures in ``status_msg``. If ``after`` is given, the job starts once
+    that task has finished.
+    """
+    async def show_queue_position(position):
+        await status_msg.edit_text(f"⏳ في قائمة الانتظار: {position} | Queued, position {position}")
+
+    user_id = update.effective_user.id
+    try:
+        if platform == "instagram":
+            if after is not None and not after.done():
+                # asyncio.wait neither raises the task's error nor cancels it.
+                await asyncio.wait([after])
+            # Posts are resolved from metadata and mostly sent by URL: always a small job.
+            async with SCHEDULER.slot(platform, show_queue_position, lane=FAST_LANE,
+                                      owner=user_id, weight=USER_LIMITS.weight(user_id)):
+                await _process_instagram(update, context, url, media_key, status_msg)
             return
 
-        # Send files
-        await status_msg.edit_text("⬆️ جاري رفع الملف... | Uploading media...")
-        
-        for file_path in files_to_send:
-            original_path = file_path
-            final_path = original_path
-
-            if WATERMARK_ENABLED:
-                try:
-                    from watermark import apply_watermark
-                    await status_msg.edit_text("🖼️ Adding watermark...")
-                    watermarked_path = await apply_watermark(original_path, WATERMARK_TEXT)
-                    if watermarked_path and os.path.exists(watermarked_path):
-                        final_path = watermarked_path
-                    else:
-                        logger.warning(f"Watermarking failed for {original_path}. Sending original file.")
-                except ImportError:
-                    logger.warning("Watermark module not available. Install moviepy to enable watermarks.")
-                except Exception as e:
-                    logger.warning(f"Watermarking failed: {e}. Sending original file.")
-
-            is_valid, size = check_file_size(final_path)
-            if is_valid:
-                try:
-                    if final_path.endswith(('.jpg', '.jpeg', '.png')):
-                        await update.message.reply_photo(photo=open(final_path, 'rb'), write_timeout=300, read_timeout=300)
-                    elif final_path.endswith(('.mp4', '.mkv', '.avi')):
-                        await update.message.reply_video(video=open(final_path, 'rb'), write_timeout=300, read_timeout=300)
-                    elif final_path.endswith(('.mp3', '.m4a', '.wav', '.flac')):
-                        await update.message.reply_audio(audio=open(final_path, 'rb'), write_timeout=300, read_timeout=300)
-                    else:
-                        await update.message.reply_document(document=open(final_path, 'rb'), write_timeout=300, read_timeout=300)
-                except Exception as e:
-                    logger.error(f"Error sending file {final_path}: {e}")
-                    await update.message.reply_text(f"❌ Failed to upload {os.path.basename(final_path)}.")
+        flight, is_leader = INFLIGHT.join(media_key)
+        tracker = PROGRESS.track(status_msg)
+        try:
+            flight.subscribe(tracker.update)
+            if is_leader:
+                INFLIGHT.start(flight, lambda: _produce(url, platform, status_msg, flight, tracker, show_queue_position, user_id))
             else:
-                await update.message.reply_text(f"⚠️ File is too large: {os.path.basename(final_path)} ({size:.2f}MB > {MAX_FILE_SIZE_MB}MB).")
-            
-            # Cleanup
-            cleanup_file(original_path)
-            if original_path != final_path:
-                cleanup_file(final_path)
-            
-            # If it was an instagram folder, we might want to clean that up too, 
-            # but our cleanup_file only handles files. 
-            # For simplicity in this script, we rely on the fact that instagram downloader 
-            # returns file paths. The folder might remain empty. 
-            # Ideally we'd clean the folder too.
-            
-        await status_msg.delete()
-
+                await status_msg.edit_text("🔗 نفس الرابط قيد التحميل بالفعل، جاري الانتظار... | Same link is already downloading, joining it...")
+            try:
+                prepared = await flight.wait()
+                await tracker.finish()
+                if not is_leader:
+                    await flight.delivered.wait()
+                await _upload_prepared(update, media_key, status_msg, prepared)
+            finally:
+                if is_leader:
+                    flight.delivered.set()
+        finally:
+            await tracker.finish()
+            # The last chat to leave an unfinished flight aborts its download.
+            INFLIGHT.release(flight)
+    except asyncio.CancelledError:
+        if scope is None or not scope.cancelled:
+            raise
+        logger.info(f"Job for {url} cancelled by user {scope.owner_id}")
+        await status_msg.close("🛑 تم إلغاء التحميل | Download cancelled")
+    except (QueueFullError, StorageFullError):
+        await status_msg.close("🚦 البوت مشغول حالياً، حاول بعد قليل.\n🚦 The bot is busy right now, please try again in a few minutes.")
     except Exception as e:
         logger.error(f"Error processing URL {url}: {e}")
-        await status_msg.edit_text(f"❌ حدث خطأ | An error occurred: {str(e)}")
+        await status_msg.close(f"❌ حدث خطأ | An error occurred: {str(e)}")
+    finally:
+        if scope is not None:
+            CANCELLATIONS.close(scope)
+        USER_LIMITS.release(user_id)
+
+
+async def _produce(url, platform, status_msg: StatusMessage, flight, tracker, show_queue_position,
+                   user_id) -> list[tuple[str, str, VideoAttributes | None]]:
+    """
+    A flight's job: downloads and prepares the media in a job directory of
+    its own. Once no chat waits for the flight any more, the download is
+    stopped at its next progress update and the job directory removed.
+    """
+    def progress(*args):
+        if flight.abandoned.is_set():
+            raise DownloadCancelled(f"Nobody is waiting for {flight.key} any more")
+        flight.publish_progress(*args)
+
+    lane = await _pick_lane(url, platform)
+    async with SCHEDULER.slot(platform, show_queue_position, lane=lane,
+                              owner=user_id, weight=USER_LIMITS.weight(user_id)):
+        # Quota checks walk the downloads tree and may wait for a running sweep: keep them off the loop.
+        job = await asyncio.to_thread(STORAGE.open_job, platform)
+        try:
+            downloaded = await _download(url, platform, status_msg, progress, job.path)
+            await tracker.finish()
+            return await _prepare(downloaded, status_msg)
+        except BaseException:
+            # Drops partial downloads and .part/merge leftovers with the job.
+            await asyncio.shield(asyncio.to_thread(STORAGE.release, job))
+            raise
+
+
+def _probe_done(probe: asyncio.Future):
+    PROBE_SLOTS.release()
+    if not probe.cancelled():
+        # Retrieve errors of probes nobody waited for any more.
+        probe.exception()
+
+
+async def _pick_lane(url, platform):
+    """
+    Chooses the scheduler lane for a download from the link's metadata. The
+    extraction is reused by the download itself; if it fails or is slow,
+    the lane is guessed from the link. The link is only probed when the job
+    would have to wait, and never when the queue is full or every probe
+    worker is busy.
+    """
+    # Shorts and the other platforms' clips are short; regular YouTube videos may be hours long.
+    guess = BULK_LANE if platform == "youtube" and "/shorts/" not in url else FAST_LANE
+    SCHEDULER.check_capacity(platform)
+    if SCHEDULER.has_free_slot(platform) or PROBE_SLOTS.locked():
+        return guess
+
+    await PROBE_SLOTS.acquire()
+    probe = asyncio.ensure_future(SCHEDULER.run("probe", probe_media, platform, url))
+    probe.add_done_callback(_probe_done)
+    try:
+        # Timing out only stops the wait; the thread keeps its probe slot until it returns.
+        estimate = await asyncio.wait_for(asyncio.shield(probe), LANE_PROBE_TIMEOUT)
+    except Exception as e:
+        logger.info(f"Could not probe {url} for its lane, guessing {guess}: {e}")
+        return guess
+    lane = SCHEDULER.lane_for(estimate.size_bytes, estimate.duration, default=guess)
+    logger.info(f"{url}: ~{estimate.size_bytes} bytes, {estimate.duration}s -> {lane} lane")
+    return lane
+
+
+async def _process_instagram(update: Update, context: ContextTypes.DEFAULT_TYPE, url, media_key, status_msg):
+    """Resolves an Instagram post and either sends it directly or offers carousel buttons."""
+    await status_msg.edit_text("🔎 جاري جلب بيانات المنشور من Instagram... | Fetching Instagram post info...")
+    media_list = await SCHEDULER.run("resolve", get_post_media, url)
+
+    if not media_list:
+        raise Exception("Empty media list")
+
+    # Carousel: show buttons; Non-carousel: send immediately.
+    if len(media_list) == 1:
+        await status_msg.delete()
+        async with SCHEDULER.upload_slot():
+            await _send_instagram_media(update.message, media_list[0], media_key)
+        return
+
+    context.user_data["ig_media_list"] = media_list
+    context.user_data["ig_media_key"] = media_key
+    await status_msg.delete()
+    await update.message.reply_text(
+        "Choose an image number:",
+        reply_markup=build_buttons(media_list),
+    )
+
+
+async def _download(url, platform, status_msg, progress_callback, output_path) -> list[str]:
+    """Downloads the media behind a link into ``output_path`` and returns the downloaded file paths."""
+    files_to_send = []
+
+    if platform == "youtube":
+        await status_msg.edit_text("⬇️ جاري التحميل من YouTube... | Downloading from YouTube...")
+        file_path = await SCHEDULER.run("download", download_youtube_video, url, output_path, progress_callback)
+        files_to_send.append(file_path)
+
+    elif platform == "twitter":
+        file_path = await SCHEDULER.run("download", download_twitter_video, url, output_path, progress_callback)
+        files_to_send.append(file_path)
+
+    elif platform == "facebook":
+        file_path = await SCHEDULER.run("download", download_facebook_video, url, output_path, progress_callback)
+        files_to_send.append(file_path)
+
+    elif platform == "tiktok":
+        await status_msg.edit_text("⬇️ جاري التحميل من TikTok... | Downloading from TikTok...")
+        file_path = await SCHEDULER.run("download", download_tiktok_video, url, output_path, progress_callback)
+        files_to_send.append(file_path)
+
+    return files_to_send
+
+
+async def _prepare(files_to_send: list[str], status_msg) -> list[tuple[str, str, VideoAttributes | None]]:
+    """
+    Applies post-processing (watermarking, faststart remux and thumbnails) to downloaded files.
+    Returns a list of (original_path, final_path, video_attributes) entries ready for upload.
+    """
+    prepared = []
+    for original_path in files_to_send:
+        final_path = original_path
+
+        if WATERMARK_ENABLED:
+            tracker = None
+            try:
+                await status_msg.edit_text("🖼️ Adding watermark...")
+                tracker = PROGRESS.track(status_msg, render=render_encode_progress)
+                watermarked_path = await WATERMARK_POOL.apply(original_path, WATERMARK_TEXT, tracker.update)
+                if watermarked_path and os.path.exists(watermarked_path):
+                    final_path = watermarked_path
+                else:
+                    logger.warning(f"Watermarking failed for {original_path}. Sending original file.")
+            except WatermarkQueueFull as e:
+                logger.warning(f"{e}. Sending original file.")
+            except Exception as e:
+                logger.warning(f"Watermarking failed: {e}. Sending original file.")
+            finally:
+                if tracker:
+                    await tracker.finish()
+
+        attributes = None
+        if STREAMING_PREP_ENABLED and final_path.endswith(('.mp4', '.mkv', '.avi', '.webm')):
+            try:
+                async with SCHEDULER.postprocess_slot():
+                    # An MKV/WebM may come back rewrapped as an MP4 next to it, in the same job directory.
+                    final_path, attributes = await prepare_for_streaming(final_path)
+            except Exception as e:
+                logger.warning(f"Preparing {final_path} for streaming failed: {e}. Sending it as is.")
+
+        prepared.append((original_path, final_path, attributes))
+    return prepared
+
+
+async def _upload_prepared(update: Update, media_key, status_msg, prepared: list[tuple[str, str, VideoAttributes | None]]):
+    """Sends prepared files to the chat, reusing a cached file_id when one exists."""
+    cache_key = _cache_key(media_key, watermarked=True)
+    if len(prepared) == 1 and await _send_cached(update.message, cache_key):
+        await status_msg.delete()
+        return
+
+    await status_msg.edit_text("⬆️ جاري رفع الملف... | Uploading media...")
+
+    for _, final_path, attributes in prepared:
+        is_valid, size = check_file_size(final_path)
+        if is_valid:
+            try:
+                async with SCHEDULER.upload_slot():
+                    sent = await _send_file(update.message, final_path, attributes)
+                if len(prepared) == 1:
+                    _remember_file_id(cache_key, sent)
+            except Exception as e:
+                logger.error(f"Error sending file {final_path}: {e}")
+                await update.message.reply_text(f"❌ Failed to upload {os.path.basename(final_path)}.")
+        else:
+            await update.message.reply_text(f"⚠️ File is too large: {os.path.basename(final_path)} ({size:.2f}MB > {MAX_FILE_SIZE_MB}MB).")
+
+    await status_msg.delete()
+
+
+def _cleanup_prepared(prepared: list[tuple[str, str, VideoAttributes | None]]):
+    """Removes downloaded and post-processed files (with their job directory) once no chat needs them any more."""
+    for original_path, final_path, attributes in prepared:
+        thumbnail = attributes.thumbnail if attributes else None
+        for path in {original_path, final_path, thumbnail} - {None}:
+            if not STORAGE.release_path(path):
+                cleanup_file(path)
+
+
+INFLIGHT = SingleFlight(cleanup=_cleanup_prepared)
 
 async def post_init(application: Application):
     """Sets the bot's menu commands."""
@@ -584,6 +1130,38 @@ async def post_init(application: Application):
     except Exception as e:
         logger.warning(f"Failed to set bot commands: {e}")
 
+def _webhook_secret() -> str:
+    """
+    Secret token Telegram must echo back in every webhook request.
+    Derived from the bot token when not configured, so every process behind
+    a load balancer agrees on it without extra setup.
+    """
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256(f"webhook:{TOKEN}".encode()).hexdigest()
+
+
+async def start_webhook(application: Application):
+    """
+    Serves updates over an embedded HTTP server instead of long polling.
+    PTB registers the webhook with set_webhook and rejects requests whose
+    secret token header does not match.
+    """
+    # The path of WEBHOOK_URL is the path the embedded server listens on.
+    url_path = WEBHOOK_URL.split("://", 1)[-1].partition("/")[2]
+    await application.updater.start_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=url_path,
+        webhook_url=WEBHOOK_URL,
+        secret_token=_webhook_secret(),
+        drop_pending_updates=True,
+        allowed_updates=Update.ALL_TYPES,
+        bootstrap_retries=3,
+    )
+    logger.info(f"Webhook mode: listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{url_path} for {WEBHOOK_URL}")
+
+
 async def main():
     """Main function to run the bot."""
     if not TOKEN:
@@ -591,20 +1169,31 @@ async def main():
         exit(1)
 
     # Build application with proper configuration for v22+
-    application = (
+    builder = (
         ApplicationBuilder()
         .token(TOKEN)
-        .read_timeout(60)
-        .write_timeout(60)
-        .connect_timeout(60)
+        .request(RoutingRequest(control=HTTP_CONTROL, bulk=HTTP_UPLOADS))
+        .get_updates_request(HTTP_UPDATES)
         .post_init(post_init)
-        .build()
+        .rate_limiter(FLOOD_CONTROL)
+        .concurrent_updates(UPDATE_PROCESSOR)
     )
+    if BOT_API_URL:
+        builder = (
+            builder.base_url(f"{BOT_API_URL}/bot")
+            .base_file_url(f"{BOT_API_URL}/file/bot")
+            .local_mode(BOT_API_LOCAL_MODE)
+        )
+    elif BOT_API_LOCAL_MODE_ENABLED:
+        logger.warning("BOT_API_LOCAL_MODE is set but BOT_API_URL is not; using the cloud Bot API.")
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("about", about_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CallbackQueryHandler(instagram_selection_callback, pattern=r"^igsel:"))
+    application.add_handler(CallbackQueryHandler(cancel_callback, pattern=r"^cancel:"))
     application.add_handler(CallbackQueryHandler(button_callback))
     application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message))
 
@@ -612,10 +1201,14 @@ async def main():
     # Initialize and run with allowed_updates to prevent conflicts and drop pending updates
     await application.initialize()
     await application.start()
-    await application.updater.start_polling(
-        drop_pending_updates=True,
-        allowed_updates=Update.ALL_TYPES
-    )
+    await STORAGE.start()
+    if WEBHOOK_URL:
+        await start_webhook(application)
+    else:
+        await application.updater.start_polling(
+            drop_pending_updates=True,
+            allowed_updates=Update.ALL_TYPES
+        )
     
     # Keep the bot running
     try:
@@ -624,8 +1217,20 @@ async def main():
         logger.info("Stopping bot...")
     finally:
         await application.updater.stop()
+        if WEBHOOK_URL and WEBHOOK_DELETE_ON_EXIT:
+            try:
+                await application.bot.delete_webhook()
+                logger.info("Webhook deleted")
+            except Exception as e:
+                logger.warning(f"Failed to delete webhook: {e}")
+        await STORAGE.stop()
         await application.stop()
         await application.shutdown()
+        await asyncio.to_thread(FILE_ID_CACHE.flush)
+        logger.info(f"HTTP pool waits: {pool_stats(HTTP_UPDATES, HTTP_CONTROL, HTTP_UPLOADS)}")
+        logger.info(f"Limits: users {USER_LIMITS.stats()}, scheduler {SCHEDULER.stats()}")
+        SCHEDULER.shutdown()
+        WATERMARK_POOL.shutdown()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,42 @@
+import asyncio
+import secrets
+from typing import Optional
+
+
+class CancelScope:
+    """A job the user who started it can cancel, e.g. with a Cancel button on its status message."""
+
+    def __init__(self, job_id: str, owner_id: int):
+        self.job_id = job_id
+        self.owner_id = owner_id
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+
+    def cancel(self) -> bool:
+        """Cancels the job's task; False if it has already finished or was cancelled."""
+        if self.cancelled or self.task is None or self.task.done():
+            return False
+        self.cancelled = True
+        self.task.cancel()
+        return True
+
+
+class CancelRegistry:
+    """Running cancellable jobs by id; ids are random so stale buttons from a previous run match nothing."""
+
+    def __init__(self):
+        self._scopes: dict[str, CancelScope] = {}
+
+    def open(self, owner_id: int) -> CancelScope:
+        job_id = secrets.token_hex(6)
+        scope = self._scopes[job_id] = CancelScope(job_id, owner_id)
+        return scope
+
+    def get(self, job_id: str) -> Optional[CancelScope]:
+        return self._scopes.get(job_id)
+
+    def close(self, scope: CancelScope):
+        self._scopes.pop(scope.job_id, None)
+
+    def __len__(self):
+        return len(self._scopes)
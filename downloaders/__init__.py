@@ -4,4 +4,5 @@ from .twitter import download_twitter_video
 from .facebook import download_facebook_video
 from .music import download_music, extract_metadata, format_metadata_message, create_metadata_file
 from .tiktok import download_tiktok_video, is_tiktok_url
-from .utils import check_file_size, cleanup_file, MAX_FILE_SIZE_MB
+from .metadata import MediaEstimate, probe_media
+from .utils import check_file_size, cleanup_file, detect_platform, get_media_key, normalize_url, DownloadCancelled, MAX_FILE_SIZE_MB, BOT_API_LOCAL_MODE_ENABLED
@@ -0,0 +1,228 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .probe import FileTooLargeError
+from .utils import DownloadCancelled
+
+logger = logging.getLogger(__name__)
+
+# Outcomes older than this no longer count, so a demoted backend gets retried eventually.
+STATS_WINDOW = int(os.getenv("BACKEND_STATS_WINDOW", "20"))
+STATS_TTL_SECONDS = float(os.getenv("BACKEND_STATS_TTL", "900"))
+# Start the next backend if the current one has not produced bytes after this many seconds (0 = off).
+HEDGE_AFTER_SECONDS = float(os.getenv("BACKEND_HEDGE_SECONDS", "0"))
+
+# backend(url, output_path, progress_callback) -> result
+Backend = tuple[str, Callable]
+
+
+class BackendSkipped(Exception):
+    """Raised by a backend that cannot handle a link (not counted as a failure)."""
+
+
+class BackendCancelled(Exception):
+    """Raised inside a losing hedged attempt to stop it at its next progress update."""
+
+
+@dataclass
+class _Outcome:
+    at: float
+    ok: bool
+    latency: float
+
+
+@dataclass
+class BackendStats:
+    """Rolling success rate and latency of one backend."""
+
+    outcomes: deque = field(default_factory=lambda: deque(maxlen=STATS_WINDOW))
+
+    def record(self, ok: bool, latency: float):
+        self.outcomes.append(_Outcome(time.time(), ok, latency))
+
+    def _recent(self) -> list[_Outcome]:
+        cutoff = time.time() - STATS_TTL_SECONDS
+        return [o for o in self.outcomes if o.at >= cutoff]
+
+    def summary(self) -> tuple[int, float, Optional[float]]:
+        """(samples, success rate, mean latency of successes)."""
+        recent = self._recent()
+        if not recent:
+            return 0, 1.0, None
+        successes = [o.latency for o in recent if o.ok]
+        rate = len(successes) / len(recent)
+        return len(recent), rate, (sum(successes) / len(successes)) if successes else None
+
+    def expected_cost(self) -> Optional[float]:
+        """Expected seconds until this backend delivers, or None without recent samples."""
+        samples, rate, latency = self.summary()
+        if not samples:
+            return None
+        failure_latency = max((o.latency for o in self._recent() if not o.ok), default=0.0)
+        if latency is None:
+            # Never succeeded recently: rank behind everything that did.
+            return float("inf")
+        return latency + (1 - rate) / max(rate, 0.05) * failure_latency
+
+
+class BackendSelector:
+    """Orders a platform's download backends by their recent success rate and latency."""
+
+    def __init__(self):
+        self._stats: dict[tuple[str, str], BackendStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, platform: str, name: str, ok: bool, latency: float):
+        with self._lock:
+            self._stats.setdefault((platform, name), BackendStats()).record(ok, latency)
+
+    def order(self, platform: str, backends: list[Backend]) -> list[Backend]:
+        """
+        Backends sorted by expected cost. Backends without recent samples keep
+        their declared position relative to each other and go before ones
+        that have only been failing.
+        """
+        with self._lock:
+            costs = [self._stats.get((platform, name), BackendStats()).expected_cost() for name, _ in backends]
+        measured = sorted(c for c in costs if c is not None and c != float("inf"))
+        # An unmeasured backend is assumed to be as good as the best measured one.
+        default = measured[0] if measured else 0.0
+        keyed = [
+            ((default if cost is None else cost), index, backend)
+            for index, (cost, backend) in enumerate(zip(costs, backends))
+        ]
+        keyed.sort(key=lambda item: (item[0], item[1]))
+        return [backend for _, _, backend in keyed]
+
+
+SELECTOR = BackendSelector()
+_HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+class _Attempt:
+    """One backend run; its progress hook doubles as the cancellation point."""
+
+    def __init__(self, name: str, progress_callback, owner: dict):
+        self.name = name
+        self.started = time.monotonic()
+        self.produced_bytes = threading.Event()
+        self.cancelled = False
+        self._progress_callback = progress_callback
+        self._owner = owner
+
+    def progress(self, downloaded, total, *extra):
+        if self.cancelled:
+            raise BackendCancelled(f"{self.name} lost the race")
+        if downloaded:
+            self.produced_bytes.set()
+            # The first attempt to produce bytes owns the job's progress display.
+            self._owner.setdefault("name", self.name)
+        if self._progress_callback and self._owner.get("name") == self.name:
+            self._progress_callback(downloaded, total, *extra)
+
+
+def run_backends(platform: str, backends: list[Backend], url, output_path, progress_callback=None,
+                 hedge_after: float = HEDGE_AFTER_SECONDS):
+    """
+    Runs a platform's backends in order of their recent performance until one
+    succeeds. Each backend writes into its own subdirectory of output_path.
+    FileTooLargeError and DownloadCancelled are final and raised immediately.
+
+    With ``hedge_after`` > 0 the next backend is started as well when none of
+    the running ones has produced bytes within that many seconds; the first
+    one to finish wins and the others are cancelled at their next progress
+    update.
+    """
+    ordered = SELECTOR.order(platform, backends)
+    logger.debug(f"{platform} backend order: {[name for name, _ in ordered]}")
+    if hedge_after and hedge_after > 0 and len(ordered) > 1:
+        return _run_hedged(platform, ordered, url, output_path, progress_callback, hedge_after)
+
+    last_error = None
+    for name, backend in ordered:
+        started = time.monotonic()
+        try:
+            result = backend(url, os.path.join(output_path, name), progress_callback)
+        except (FileTooLargeError, DownloadCancelled):
+            raise
+        except BackendSkipped as e:
+            logger.info(f"{platform}/{name} skipped: {e}")
+            last_error = e
+            continue
+        except Exception as e:
+            SELECTOR.record(platform, name, False, time.monotonic() - started)
+            logger.warning(f"{platform}/{name} failed: {e}")
+            last_error = e
+            continue
+        SELECTOR.record(platform, name, True, time.monotonic() - started)
+        return result
+    raise last_error or Exception(f"No {platform} backend available")
+
+
+def _run_hedged(platform, ordered, url, output_path, progress_callback, hedge_after):
+    pending = list(ordered)
+    running = {}
+    owner: dict = {}
+    last_error = None
+    last_launch = 0.0
+
+    def launch():
+        nonlocal last_launch
+        name, backend = pending.pop(0)
+        attempt = _Attempt(name, progress_callback, owner)
+        future = _HEDGE_EXECUTOR.submit(backend, url, os.path.join(output_path, name), attempt.progress)
+        running[future] = attempt
+        last_launch = time.monotonic()
+
+    def cancel_running():
+        for attempt in running.values():
+            attempt.cancelled = True
+
+    launch()
+    try:
+        while running:
+            timeout = None
+            if pending and not any(a.produced_bytes.is_set() for a in running.values()):
+                timeout = max(0.0, last_launch + hedge_after - time.monotonic())
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if not any(a.produced_bytes.is_set() for a in running.values()):
+                    logger.info(f"{platform}: no bytes after {hedge_after:g}s, hedging with {pending[0][0]}")
+                    launch()
+                continue
+
+            for future in done:
+                attempt = running.pop(future)
+                latency = time.monotonic() - attempt.started
+                try:
+                    result = future.result()
+                except (FileTooLargeError, DownloadCancelled):
+                    raise
+                except BackendCancelled:
+                    continue
+                except BackendSkipped as e:
+                    logger.info(f"{platform}/{attempt.name} skipped: {e}")
+                    last_error = e
+                    continue
+                except Exception as e:
+                    SELECTOR.record(platform, attempt.name, False, latency)
+                    logger.warning(f"{platform}/{attempt.name} failed: {e}")
+                    last_error = e
+                    if owner.get("name") == attempt.name:
+                        # Let a still-running attempt take over the progress display.
+                        owner.pop("name")
+                    continue
+                SELECTOR.record(platform, attempt.name, True, latency)
+                return result
+
+            if not running and pending:
+                launch()
+    finally:
+        cancel_running()
+    raise last_error or Exception(f"No {platform} backend available")
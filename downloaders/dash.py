@@ -0,0 +1,184 @@
+import logging
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .probe import MAX_FILE_SIZE_BYTES, FileTooLargeError, estimate_size
+from .utils import FFMPEG_BINARY
+from .ytdlp_pool import ytdlp_extractor
+
+logger = logging.getLogger(__name__)
+
+# Telegram clients rarely benefit from more than 1080p, and it keeps files within the size cap.
+MAX_HEIGHT = int(os.getenv("YOUTUBE_MAX_HEIGHT", "1080"))
+CONCURRENT_FRAGMENTS = int(os.getenv("YTDLP_CONCURRENT_FRAGMENTS", "4"))
+# Ranged requests of this size avoid YouTube's per-connection throttling on plain https formats.
+HTTP_CHUNK_SIZE = 10 * 1024 * 1024
+
+_STREAM_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="dash")
+
+
+class _StreamsCancelled(Exception):
+    pass
+
+
+def dash_opts():
+    """yt-dlp options for downloading single adaptive streams quickly."""
+    return {
+        'concurrent_fragment_downloads': CONCURRENT_FRAGMENTS,
+        'http_chunk_size': HTTP_CHUNK_SIZE,
+        # Progress goes to the job's hooks, not the console.
+        'noprogress': True,
+    }
+
+
+def _is_video_only(fmt):
+    return fmt.get('vcodec') not in (None, 'none') and fmt.get('acodec') == 'none'
+
+
+def _is_audio_only(fmt):
+    return fmt.get('acodec') not in (None, 'none') and fmt.get('vcodec') == 'none'
+
+
+def _stream_size(info, fmt):
+    return estimate_size({**fmt, 'duration': info.get('duration')})
+
+
+def select_dash_formats(info, budget=MAX_FILE_SIZE_BYTES):
+    """
+    Picks the best video-only + audio-only pair whose combined size fits the
+    budget, preferring H.264 video and AAC audio (which play everywhere once
+    muxed into MP4). Returns (video_format, audio_format) or None.
+    """
+    formats = info.get('formats') or []
+    audios = [f for f in formats if _is_audio_only(f) and _stream_size(info, f)]
+    if not audios:
+        return None
+    audio = max(audios, key=lambda f: (f.get('ext') == 'm4a', f.get('abr') or f.get('tbr') or 0))
+    remaining = budget - _stream_size(info, audio)
+
+    videos = [
+        f for f in formats
+        if _is_video_only(f) and (f.get('height') or 0) <= MAX_HEIGHT
+    ]
+    videos.sort(
+        key=lambda f: (
+            (f.get('vcodec') or '').startswith('avc1'),
+            f.get('height') or 0,
+            f.get('tbr') or 0,
+        ),
+        reverse=True,
+    )
+    for video in videos:
+        size = _stream_size(info, video)
+        if size and size <= remaining:
+            return video, audio
+    return None
+
+
+def mux_streams(video_path, audio_path, output_path, heartbeat=None):
+    """
+    Muxes separate video and audio files into MP4 without re-encoding.
+    ``heartbeat`` is called about twice a second while ffmpeg runs; if it
+    raises (e.g. DownloadCancelled), ffmpeg is killed and the error re-raised.
+    """
+    command = [
+        FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+        "-i", video_path, "-i", audio_path,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c", "copy",
+        output_path,
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        while True:
+            try:
+                _, stderr = process.communicate(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                if heartbeat is not None:
+                    heartbeat()
+    except BaseException:
+        process.kill()
+        process.wait()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg mux failed with code {process.returncode}: {stderr.strip()[-500:]}")
+    return output_path
+
+
+def download_dash(platform, info, formats, base_path, opts, progress_callback=None):
+    """
+    Downloads the given formats of an already extracted ``info`` concurrently,
+    one pooled YoutubeDL per stream, and muxes them into ``base_path``.mp4.
+    Progress is reported as the sum over all streams.
+    """
+    state = {fmt['format_id']: [0, _stream_size(info, fmt) or 0, 0.0] for fmt in formats}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def report(format_id, d):
+        if stop.is_set():
+            raise _StreamsCancelled()
+        if d['status'] != 'downloading':
+            return
+        with lock:
+            entry = state[format_id]
+            entry[0] = d.get('downloaded_bytes', 0)
+            entry[1] = d.get('total_bytes') or d.get('total_bytes_estimate') or entry[1]
+            entry[2] = d.get('speed') or 0.0
+            downloaded = sum(e[0] for e in state.values())
+            total = sum(e[1] for e in state.values())
+            speed = sum(e[2] for e in state.values())
+        if downloaded > MAX_FILE_SIZE_BYTES:
+            # Streams without an advertised size are only caught here.
+            raise FileTooLargeError(downloaded)
+        if progress_callback and total:
+            eta = (total - downloaded) / speed if speed else None
+            progress_callback(downloaded, total, speed or None, eta)
+
+    def fetch(fmt):
+        path = f"{base_path}.f{fmt['format_id']}.{fmt['ext']}"
+        stream_info = dict(info)
+        stream_info.pop('requested_formats', None)
+        stream_info.update(fmt)
+        try:
+            with ytdlp_extractor(platform, opts, lambda d: report(fmt['format_id'], d)) as ydl:
+                success, _ = ydl.dl(path, stream_info)
+            if not success:
+                raise RuntimeError(f"Download of format {fmt['format_id']} failed")
+            return path
+        except BaseException:
+            # Stop the sibling stream at its next progress update.
+            stop.set()
+            raise
+
+    futures = [_STREAM_EXECUTOR.submit(fetch, fmt) for fmt in formats]
+    errors = []
+    paths = []
+    for future in futures:
+        try:
+            paths.append(future.result())
+        except _StreamsCancelled:
+            pass
+        except BaseException as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+
+    heartbeat = None
+    if progress_callback:
+        total = sum(e[1] for e in state.values())
+        # Keeps the progress callback in charge of cancelling the job while ffmpeg muxes.
+        heartbeat = lambda: progress_callback(total, total, None, 0)
+    output_path = base_path + ".mp4"
+    try:
+        mux_streams(paths[0], paths[1], output_path, heartbeat)
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return output_path
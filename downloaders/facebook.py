@@ -1,6 +1,8 @@
 import logging
 import os
-import yt_dlp
+
+from .probe import downloaded_file, probe_and_download, size_gate_opts, size_guard, size_limited_format
+from .ytdlp_pool import ytdlp_extractor
 
 logger = logging.getLogger(__name__)
 
@@ -20,17 +22,17 @@ def download_facebook_video(url, output_path="downloads", progress_callback=None
                     total = d.get('total_bytes') or d.get('total_bytes_estimate')
                     downloaded = d.get('downloaded_bytes', 0)
                     if total:
-                        progress_callback(downloaded, total)
+                        progress_callback(downloaded, total, d.get('speed'), d.get('eta'))
 
         ydl_opts = {
-            'format': 'best[ext=mp4]/best',
+            'format': size_limited_format('best[ext=mp4]/best'),
             'outtmpl': os.path.join(output_path, 'fb_%(id)s.%(ext)s'),
             'quiet': True,
-            'progress_hooks': [ytdlp_progress],
+            **size_gate_opts(),
         }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
+        with ytdlp_extractor("facebook", ydl_opts, size_guard(ytdlp_progress)) as ydl:
+            info = probe_and_download(ydl, url)
+            filename = downloaded_file(ydl.prepare_filename(info))
             return filename
     except Exception as e:
         logger.error(f"Facebook download failed: {e}")
@@ -15,8 +15,10 @@ from instaloader.exceptions import (
     LoginRequiredException,
     PrivateProfileNotFollowedException,
     QueryReturnedBadRequestException,
+    TooManyRequestsException,
 )
 
+from .instagram_sessions import SESSION_POOL, InstagramRateLimited
 from .utils import get_ytdlp_opts
 
 logger = logging.getLogger(__name__)
@@ -41,6 +43,35 @@ def _extract_shortcode(url: str) -> str:
     return match.group(1)
 
 
+def _is_block_error(e: Exception) -> bool:
+    err_msg = str(e).lower()
+    return "401" in err_msg or "429" in err_msg or "wait a few minutes" in err_msg
+
+
+def _fetch_post(shortcode: str, cookies_path: str | None = None) -> instaloader.Post:
+    """Fetches post metadata through the shared session pool, retrying once on another session if blocked."""
+    attempts = 1 if cookies_path is not None else min(2, SESSION_POOL.session_count())
+    for attempt in range(attempts):
+        try:
+            with SESSION_POOL.session(cookies_path) as session:
+                try:
+                    return instaloader.Post.from_shortcode(session.loader.context, shortcode)
+                except (BadResponseException, QueryReturnedBadRequestException, ConnectionException) as e:
+                    if isinstance(e, TooManyRequestsException) or _is_block_error(e):
+                        SESSION_POOL.report_blocked(session)
+                        if attempt + 1 < attempts:
+                            continue
+                    raise
+        except InstagramRateLimited as e:
+            raise ValueError(str(e))
+        except (LoginRequiredException, PrivateProfileNotFollowedException):
+            raise ValueError("Private post or login required")
+        except (BadResponseException, QueryReturnedBadRequestException, ConnectionException, InvalidArgumentException) as e:
+            raise ValueError(f"Instagram post unavailable: {e}")
+        except Exception as e:
+            raise ValueError(f"Failed to fetch Instagram post: {e}")
+
+
 def get_post_media(url: str, cookies_path: str | None = None) -> List[InstagramMedia]:
     """Fetch Instagram post media using instaloader without downloading files.
 
@@ -53,56 +84,15 @@ def get_post_media(url: str, cookies_path: str | None = None) -> List[InstagramM
     Notes:
     - Works for public posts without login in most cases.
     - For private/unavailable posts, raises a ValueError with a user-friendly message.
+    - Uses the shared, rate-limited Instaloader sessions; ``cookies_path`` pins
+      the request to the session for that cookie file.
     """
     if not isinstance(url, str) or not url.strip():
         raise ValueError("Empty URL")
 
     shortcode = _extract_shortcode(url.strip())
 
-    # Keep instaloader configured to avoid local downloads; we only want metadata/URLs.
-    loader = instaloader.Instaloader(
-        download_pictures=False,
-        download_videos=False,
-        download_video_thumbnails=False,
-        download_geotags=False,
-        download_comments=False,
-        save_metadata=False,
-        compress_json=False,
-        quiet=True,
-        user_agent=(
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/135.0.0.0 Safari/537.36"
-        ),
-    )
-
-    # Load cookies if provided or if cookies.txt exists in repo root.
-    if cookies_path is None:
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        candidate = os.path.join(base_dir, "cookies.txt")
-        cookies_path = candidate if os.path.exists(candidate) else None
-
-    if cookies_path and os.path.exists(cookies_path):
-        try:
-            loader.context.load_cookies_from_file(cookies_path)
-            logger.info("Instaloader(get_post_media): Loaded cookies")
-        except Exception as ce:
-            logger.warning(f"Instaloader(get_post_media): Failed to load cookies: {ce}")
-
-    # Add Referer header to reduce 401/429 issues.
-    try:
-        loader.context._session.headers.update({"Referer": "https://www.instagram.com/"})
-    except Exception:
-        pass
-
-    try:
-        post = instaloader.Post.from_shortcode(loader.context, shortcode)
-    except (LoginRequiredException, PrivateProfileNotFollowedException):
-        raise ValueError("Private post or login required")
-    except (BadResponseException, QueryReturnedBadRequestException, ConnectionException, InvalidArgumentException) as e:
-        raise ValueError(f"Instagram post unavailable: {e}")
-    except Exception as e:
-        raise ValueError(f"Failed to fetch Instagram post: {e}")
+    post = _fetch_post(shortcode, cookies_path)
 
     media: List[InstagramMedia] = []
 
@@ -142,131 +132,138 @@ def get_post_media(url: str, cookies_path: str | None = None) -> List[InstagramM
 
     return media
 
-def download_instagram_content(url, output_path="downloads"):
-    """
-    Downloads Instagram post (image or video) using Instaloader with yt-dlp as fallback.
-    Returns a list of paths to downloaded files (media).
-    """
+def _download_with_instaloader(url, output_path):
+    logger.info(f"Attempting Instagram download with Instaloader: {url}")
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     cookies_path = os.path.join(base_dir, "cookies.txt")
 
-    # Try Instaloader first
-    try:
-        logger.info(f"Attempting Instagram download with Instaloader: {url}")
-        L = instaloader.Instaloader(
-            download_pictures=True,
-            download_videos=True, 
-            download_video_thumbnails=False,
-            download_geotags=False,
-            download_comments=False,
-            save_metadata=False,
-            compress_json=False,
-            quiet=True,
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36'
-        )
-
-        # Load cookies if available
-        if os.path.exists(cookies_path):
-            try:
-                L.context.load_cookies_from_file(cookies_path)
-                logger.info("Instaloader: Loaded cookies from cookies.txt")
-            except Exception as ce:
-                logger.warning(f"Instaloader: Failed to load cookies: {ce}")
-
-        # Extract shortcode from URL
-        if "/p/" in url:
-            shortcode = url.split("/p/")[1].split("/")[0]
-        elif "/reel/" in url:
-            shortcode = url.split("/reel/")[1].split("/")[0]
-        elif "/reels/" in url:
-            shortcode = url.split("/reels/")[1].split("/")[0]
-        else:
-            raise ValueError("Invalid Instagram URL format for Instaloader")
-
-        # Add Referer header to reduce 401/429 errors
-        L.context._session.headers.update({
-            "Referer": "https://www.instagram.com/",
-        })
-        post = instaloader.Post.from_shortcode(L.context, shortcode)
-        
-        target_dir = os.path.join(output_path, shortcode)
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir)
-            
-        cwd = os.getcwd()
+    L = instaloader.Instaloader(
+        # Write into output_path/<shortcode> directly instead of chdir-ing, which is process-wide.
+        dirname_pattern=os.path.join(output_path, "{target}"),
+        download_pictures=True,
+        download_videos=True, 
+        download_video_thumbnails=False,
+        download_geotags=False,
+        download_comments=False,
+        save_metadata=False,
+        compress_json=False,
+        quiet=True,
+        user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36'
+    )
+
+    # Load cookies if available
+    if os.path.exists(cookies_path):
         try:
-            os.chdir(output_path)
-            L.download_post(post, target=shortcode)
-        finally:
-            os.chdir(cwd)
-
-        # Find the media files
-        media_files = []
-        extensions = ['*.jpg', '*.mp4', '*.png', '*.jpeg']
-        for ext in extensions:
-            media_files.extend(glob.glob(os.path.join(target_dir, ext)))
-            
+            L.context.load_cookies_from_file(cookies_path)
+            logger.info("Instaloader: Loaded cookies from cookies.txt")
+        except Exception as ce:
+            logger.warning(f"Instaloader: Failed to load cookies: {ce}")
+
+    # Extract shortcode from URL
+    if "/p/" in url:
+        shortcode = url.split("/p/")[1].split("/")[0]
+    elif "/reel/" in url:
+        shortcode = url.split("/reel/")[1].split("/")[0]
+    elif "/reels/" in url:
+        shortcode = url.split("/reels/")[1].split("/")[0]
+    else:
+        raise ValueError("Invalid Instagram URL format for Instaloader")
+
+    # Add Referer header to reduce 401/429 errors
+    L.context._session.headers.update({
+        "Referer": "https://www.instagram.com/",
+    })
+    post = instaloader.Post.from_shortcode(L.context, shortcode)
+    L.download_post(post, target=shortcode)
+
+    # Find the media files
+    target_dir = os.path.join(output_path, shortcode)
+    media_files = []
+    extensions = ['*.jpg', '*.mp4', '*.png', '*.jpeg']
+    for ext in extensions:
+        media_files.extend(glob.glob(os.path.join(target_dir, ext)))
+
+    if not media_files:
+        raise Exception("Instaloader finished but no files were found.")
+    logger.info(f"Instaloader download success: {media_files}")
+    return media_files
+
+def _download_with_ytdlp(url, output_path, progress_callback=None):
+    logger.info(f"Attempting Instagram download with yt-dlp: {url}")
+
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cookies_path = os.path.join(base_dir, "cookies.txt")
+
+    # Create a unique directory for this download to avoid conflicts
+    timestamp = int(time.time())
+    temp_dir = os.path.join(output_path, f"ig_{timestamp}")
+    if not os.path.exists(temp_dir):
+        os.makedirs(temp_dir)
+
+    def ytdlp_progress(d):
+        if d['status'] == 'downloading':
+            if progress_callback:
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                downloaded = d.get('downloaded_bytes', 0)
+                if total:
+                    progress_callback(downloaded, total, d.get('speed'), d.get('eta'))
+
+    # Use 'best' instead of 'bestvideo+bestaudio' to handle images/carousels 
+    # that might not have a "video format" in the traditional sense
+    ydl_opts = get_ytdlp_opts({
+        'format': 'best',
+        'outtmpl': os.path.join(temp_dir, '%(id)s.%(ext)s'),
+        'noplaylist': False,
+        'merge_output_format': 'mp4',
+        'cookiefile': cookies_path,  # Critical for Brave + Python 3.13 DPAPI compatibility
+        'progress_hooks': [ytdlp_progress],
+        'http_headers': {
+            'User-Agent': (
+                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+                'AppleWebKit/537.36 (KHTML, like Gecko) '
+                'Chrome/135.0.0.0 Safari/537.36'
+            )
+        },
+    })
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+        if 'entries' in info:
+            # It's a playlist or multiple entries
+            files = [ydl.prepare_filename(entry) for entry in info['entries']]
+        else:
+            files = [ydl.prepare_filename(info)]
+
+        # Filter existing files
+        media_files = [f for f in files if os.path.exists(f)]
+
         if media_files:
-            logger.info(f"Instaloader download success: {media_files}")
+            logger.info(f"yt-dlp download success: {media_files}")
             return media_files
-            
-    except Exception as e:
-        logger.warning(f"Instaloader failed: {e}. Switching to yt-dlp.")
 
-    # Fallback to yt-dlp
-    try:
-        logger.info(f"Attempting Instagram download with yt-dlp: {url}")
-        
-        # Create a unique directory for this download to avoid conflicts
-        timestamp = int(time.time())
-        temp_dir = os.path.join(output_path, f"ig_{timestamp}")
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
-
-        # Use 'best' instead of 'bestvideo+bestaudio' to handle images/carousels 
-        # that might not have a "video format" in the traditional sense
-        ydl_opts = get_ytdlp_opts({
-            'format': 'best',
-            'outtmpl': os.path.join(temp_dir, '%(id)s.%(ext)s'),
-            'noplaylist': False,
-            'merge_output_format': 'mp4',
-            'cookiefile': cookies_path,  # Critical for Brave + Python 3.13 DPAPI compatibility
-            'http_headers': {
-                'User-Agent': (
-                    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                    'AppleWebKit/537.36 (KHTML, like Gecko) '
-                    'Chrome/135.0.0.0 Safari/537.36'
-                )
-            },
-        })
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            if 'entries' in info:
-                # It's a playlist or multiple entries
-                files = [ydl.prepare_filename(entry) for entry in info['entries']]
-            else:
-                files = [ydl.prepare_filename(info)]
-            
-            # Filter existing files
-            media_files = [f for f in files if os.path.exists(f)]
-            
-            if media_files:
-                logger.info(f"yt-dlp download success: {media_files}")
-                return media_files
-            else:
-                # One last attempt to find ANY file in the temp_dir if filenames don't match exactly
-                for ext in ['*.jpg', '*.mp4', '*.png', '*.jpeg']:
-                    media_files.extend(glob.glob(os.path.join(temp_dir, ext)))
-                
-                if media_files:
-                    return list(set(media_files)) # deduplicate
-                
-                raise Exception("yt-dlp finished but no files were found.")
+        # One last attempt to find ANY file in the temp_dir if filenames don't match exactly
+        for ext in ['*.jpg', '*.mp4', '*.png', '*.jpeg']:
+            media_files.extend(glob.glob(os.path.join(temp_dir, ext)))
+
+        if media_files:
+            return list(set(media_files)) # deduplicate
+
+        raise Exception("yt-dlp finished but no files were found.")
 
+def download_instagram_content(url, output_path="downloads", progress_callback=None):
+    """
+    Downloads Instagram post (image or video) using Instaloader with yt-dlp as fallback.
+    Returns a list of paths to downloaded files (media).
+    """
+    try:
+        try:
+            return _download_with_instaloader(url, output_path)
+        except Exception as e:
+            logger.warning(f"Instaloader failed: {e}. Falling back to yt-dlp...")
+        return _download_with_ytdlp(url, output_path, progress_callback)
     except Exception as e:
         logger.error(f"Both Instaloader and yt-dlp failed for Instagram: {e}")
         err_msg = str(e).lower()
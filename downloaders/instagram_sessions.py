@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+import instaloader
+from instaloader.exceptions import TooManyRequestsException
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/135.0.0.0 Safari/537.36"
+)
+
+# Per-session request budget; we back off before Instagram starts answering 401/429.
+MAX_REQUESTS_PER_WINDOW = int(os.getenv("INSTAGRAM_MAX_REQUESTS", "20"))
+RATE_WINDOW_SECONDS = float(os.getenv("INSTAGRAM_RATE_WINDOW", "60"))
+BLOCK_COOLDOWN_SECONDS = float(os.getenv("INSTAGRAM_BLOCK_COOLDOWN", "300"))
+MAX_WAIT_SECONDS = float(os.getenv("INSTAGRAM_MAX_WAIT", "30"))
+
+
+class InstagramRateLimited(Exception):
+    """Raised when every session is over its budget or cooling down after a block."""
+
+
+class _FailFastRateController(instaloader.RateController):
+    """
+    Instaloader normally sleeps (possibly for minutes) on a 429 while holding
+    the worker thread. Raise instead so the pool can cool this session down
+    and move the request to another one.
+    """
+
+    def handle_429(self, query_type: str) -> None:
+        raise TooManyRequestsException("429 Too Many Requests")
+
+
+def _new_metadata_loader(cookies_path: Optional[str]) -> instaloader.Instaloader:
+    # Keep instaloader configured to avoid local downloads; we only want metadata/URLs.
+    loader = instaloader.Instaloader(
+        download_pictures=False,
+        download_videos=False,
+        download_video_thumbnails=False,
+        download_geotags=False,
+        download_comments=False,
+        save_metadata=False,
+        compress_json=False,
+        quiet=True,
+        user_agent=USER_AGENT,
+        rate_controller=_FailFastRateController,
+    )
+
+    if cookies_path and os.path.exists(cookies_path):
+        try:
+            loader.context.load_cookies_from_file(cookies_path)
+            logger.info(f"Instaloader session: Loaded cookies from {cookies_path}")
+        except Exception as ce:
+            logger.warning(f"Instaloader session: Failed to load cookies from {cookies_path}: {ce}")
+
+    # Add Referer header to reduce 401/429 issues.
+    try:
+        loader.context._session.headers.update({"Referer": "https://www.instagram.com/"})
+    except Exception:
+        pass
+    return loader
+
+
+@dataclass
+class InstagramSession:
+    """One long-lived Instaloader context (and its keep-alive HTTP session)."""
+
+    name: str
+    cookies_path: Optional[str]
+    loader: instaloader.Instaloader
+    requests: deque = field(default_factory=deque)
+    cooldown_until: float = 0.0
+    busy: bool = False
+
+    def _prune(self, now: float):
+        while self.requests and now - self.requests[0] >= RATE_WINDOW_SECONDS:
+            self.requests.popleft()
+
+    def available_at(self, now: float) -> float:
+        """Earliest time at which this session may make another request."""
+        self._prune(now)
+        ready = max(now, self.cooldown_until)
+        if len(self.requests) >= MAX_REQUESTS_PER_WINDOW:
+            ready = max(ready, self.requests[0] + RATE_WINDOW_SECONDS)
+        return ready
+
+
+class InstagramSessionPool:
+    """
+    Round-robin pool of logged-in (or anonymous) Instaloader sessions.
+
+    Each session keeps its own sliding-window request count and is used by one
+    thread at a time. A session that gets blocked is put on cooldown and the
+    next request goes to another one.
+    """
+
+    def __init__(self, cookie_files: list[Optional[str]]):
+        self._cookie_files = cookie_files or [None]
+        self._sessions: list[InstagramSession] = []
+        self._by_cookies: dict[Optional[str], InstagramSession] = {}
+        self._next = 0
+        self._cond = threading.Condition()
+
+    def _ensure_sessions(self):
+        if self._sessions:
+            return
+        for i, cookies_path in enumerate(self._cookie_files):
+            self._add_session(f"ig{i}", cookies_path)
+
+    def _add_session(self, name: str, cookies_path: Optional[str]) -> InstagramSession:
+        session = InstagramSession(name=name, cookies_path=cookies_path, loader=_new_metadata_loader(cookies_path))
+        self._sessions.append(session)
+        self._by_cookies[cookies_path] = session
+        return session
+
+    def _pick(self, now: float, candidates: list[InstagramSession]) -> tuple[Optional[InstagramSession], float]:
+        """Returns the next free session in round-robin order, or the time to wait for one."""
+        earliest = float("inf")
+        for offset in range(len(candidates)):
+            session = candidates[(self._next + offset) % len(candidates)]
+            if session.busy:
+                continue
+            ready = session.available_at(now)
+            if ready <= now:
+                self._next = (self._next + offset + 1) % len(candidates)
+                return session, now
+            earliest = min(earliest, ready)
+        return None, earliest
+
+    @contextmanager
+    def session(self, cookies_path: Optional[str] = None):
+        """
+        Checks out a session and counts one request against its budget.
+        Waits up to MAX_WAIT_SECONDS for a session to free up, then raises
+        InstagramRateLimited rather than risking a block.
+        """
+        deadline = time.monotonic() + MAX_WAIT_SECONDS
+        with self._cond:
+            self._ensure_sessions()
+            if cookies_path is not None and cookies_path not in self._by_cookies:
+                self._add_session(f"ig{len(self._sessions)}", cookies_path)
+            candidates = [self._by_cookies[cookies_path]] if cookies_path is not None else self._sessions
+
+            while True:
+                now = time.time()
+                session, ready = self._pick(now, candidates)
+                if session is not None:
+                    break
+                remaining = deadline - time.monotonic()
+                if ready - now > remaining:
+                    raise InstagramRateLimited(
+                        "Instagram rate limit reached on all sessions. Please try again in a few minutes."
+                    )
+                # Woken early when a busy session is returned.
+                self._cond.wait(timeout=max(0.05, min(ready - now, remaining)))
+
+            session.busy = True
+            session.requests.append(now)
+
+        try:
+            yield session
+        finally:
+            with self._cond:
+                session.busy = False
+                self._cond.notify_all()
+
+    def report_blocked(self, session: InstagramSession):
+        """Puts a session on cooldown after Instagram answered 401/429."""
+        with self._cond:
+            session.cooldown_until = time.time() + BLOCK_COOLDOWN_SECONDS
+            self._cond.notify_all()
+        logger.warning(f"Instagram session {session.name} blocked; cooling down for {BLOCK_COOLDOWN_SECONDS:.0f}s")
+
+    def session_count(self) -> int:
+        with self._cond:
+            self._ensure_sessions()
+            return len(self._sessions)
+
+
+def _configured_cookie_files() -> list[Optional[str]]:
+    """
+    Cookie files to round-robin across: INSTAGRAM_COOKIE_FILES (comma separated)
+    or cookies.txt in the project root. Falls back to one anonymous session.
+    """
+    configured = [p.strip() for p in os.getenv("INSTAGRAM_COOKIE_FILES", "").split(",") if p.strip()]
+    if configured:
+        return configured
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    candidate = os.path.join(base_dir, "cookies.txt")
+    return [candidate if os.path.exists(candidate) else None]
+
+
+SESSION_POOL = InstagramSessionPool(_configured_cookie_files())
@@ -0,0 +1,56 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from .probe import MAX_FILE_SIZE_BYTES, estimate_size, remember_info
+from .tiktok import TIKTOK_USER_AGENT
+from .utils import get_ytdlp_opts
+from .ytdlp_pool import ytdlp_extractor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MediaEstimate:
+    """What a link will cost to download, as far as its metadata tells; unknown values are None."""
+
+    size_bytes: Optional[int] = None
+    duration: Optional[float] = None
+
+
+def _extract_opts(platform):
+    # Same client settings as the platform's downloader, so the extraction can be reused by it.
+    if platform == "youtube":
+        return get_ytdlp_opts()
+    opts = {'quiet': True, 'no_warnings': True}
+    if platform == "tiktok":
+        opts['user_agent'] = TIKTOK_USER_AGENT
+    return opts
+
+
+def _expected_size(info):
+    """Size of the largest format within MAX_FILE_SIZE_MB, roughly what the downloader will pick."""
+    sizes = [
+        estimate_size({**fmt, 'duration': info.get('duration')})
+        for fmt in info.get('formats') or [info]
+    ]
+    sizes = [size for size in sizes if size]
+    within = [size for size in sizes if size <= MAX_FILE_SIZE_BYTES]
+    if within:
+        return max(within)
+    return min(sizes) if sizes else None
+
+
+def probe_media(platform, url):
+    """
+    Extracts a link's metadata without downloading and returns its expected
+    size and duration. The raw extraction is kept for the download that
+    follows, so probing does not cost a second round-trip to the site.
+    """
+    with ytdlp_extractor(platform, _extract_opts(platform)) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+    remember_info(url, info)
+    if info.get('_type', 'video') != 'video':
+        # Playlists and redirects: nothing to measure without resolving further.
+        return MediaEstimate()
+    return MediaEstimate(size_bytes=_expected_size(info), duration=info.get('duration'))
@@ -3,9 +3,11 @@ import os
 import json
 from datetime import datetime
 from typing import Dict, Tuple, Optional
-import yt_dlp
 from pathlib import Path
 
+from .probe import FileTooLargeError, downloaded_file, probe_and_download, size_gate_opts, size_guard, size_limited_format
+from .ytdlp_pool import ytdlp_extractor
+
 logger = logging.getLogger(__name__)
 
 def download_music(url: str, output_path: str = "downloads", progress_callback=None) -> Tuple[str, Dict]:
@@ -25,14 +27,15 @@ def download_music(url: str, output_path: str = "downloads", progress_callback=N
                     total = d.get('total_bytes') or d.get('total_bytes_estimate')
                     downloaded = d.get('downloaded_bytes', 0)
                     if total:
-                        progress_callback(downloaded, total)
+                        progress_callback(downloaded, total, d.get('speed'), d.get('eta'))
             elif d['status'] == 'finished':
                 if progress_callback:
-                    progress_callback(100, 100)
+                    size = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+                    progress_callback(size, size)
 
         # Extract metadata and download audio
         ydl_opts = {
-            'format': 'bestaudio[ext=m4a]/bestaudio/best',
+            'format': size_limited_format('bestaudio[ext=m4a]/bestaudio/best'),
             'postprocessors': [
                 {
                     'key': 'FFmpegExtractAudio',
@@ -43,14 +46,14 @@ def download_music(url: str, output_path: str = "downloads", progress_callback=N
             'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
             'quiet': False,
             'no_warnings': False,
-            'progress_hooks': [progress_hook],
             'extract_flat': False,
             'no_color': True,
+            **size_gate_opts(),
         }
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with ytdlp_extractor("music", ydl_opts, size_guard(progress_hook)) as ydl:
             logger.info("Extracting metadata...")
-            info = ydl.extract_info(url, download=True)
+            info = probe_and_download(ydl, url)
             
             # Get the downloaded file path
             file_path = ydl.prepare_filename(info)
@@ -59,6 +62,7 @@ def download_music(url: str, output_path: str = "downloads", progress_callback=N
             mp3_path = os.path.splitext(file_path)[0] + '.mp3'
             if os.path.exists(mp3_path):
                 file_path = mp3_path
+            file_path = downloaded_file(file_path)
             
             # Extract and organize metadata
             metadata = extract_metadata(info, file_path)
@@ -66,6 +70,8 @@ def download_music(url: str, output_path: str = "downloads", progress_callback=N
             logger.info(f"Music download successful: {file_path}")
             return file_path, metadata
 
+    except FileTooLargeError:
+        raise
     except Exception as e:
         logger.error(f"Error downloading music: {e}")
         raise Exception(f"Failed to download music: {str(e)}")
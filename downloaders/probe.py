@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+import time
+
+from .utils import MAX_FILE_SIZE_MB
+
+logger = logging.getLogger(__name__)
+
+MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+# Raw extractions made to classify a job are reused by its download if it starts within this time.
+PROBED_INFO_TTL_SECONDS = 120
+PROBED_INFO_MAX_ENTRIES = 64
+
+_probed_info: dict[str, tuple[float, dict]] = {}
+_probed_lock = threading.Lock()
+
+
+class FileTooLargeError(Exception):
+    """Raised when the probed or the downloaded media exceeds MAX_FILE_SIZE_MB."""
+
+    def __init__(self, size_bytes):
+        self.size_mb = size_bytes / (1024 * 1024)
+        super().__init__(
+            f"⚠️ الملف أكبر من الحد المسموح | File is too large "
+            f"({self.size_mb:.2f}MB > {MAX_FILE_SIZE_MB}MB)"
+        )
+
+
+def size_limited_format(format_spec, max_mb=MAX_FILE_SIZE_MB):
+    """
+    Adds size filters to every alternative of a yt-dlp format spec, so yt-dlp
+    picks the best format under the cap. Formats without a known size are
+    still allowed ('<?'); those are caught by the probe or by max_filesize.
+    """
+    # MiB, like MAX_FILE_SIZE_BYTES and check_file_size; yt-dlp's plain "M" is 10^6 bytes.
+    size_filter = f"[filesize<?{max_mb}MiB][filesize_approx<?{max_mb}MiB]"
+    alternatives = []
+    for alternative in format_spec.split("/"):
+        parts = [part + size_filter for part in alternative.split("+")]
+        alternatives.append("+".join(parts))
+    # Keep the unfiltered spec as a last resort so unknown-size media still resolves.
+    return "/".join(alternatives + [format_spec])
+
+
+def estimate_size(info):
+    """Best-effort size in bytes of the format(s) yt-dlp selected, or None if unknown."""
+    formats = info.get("requested_formats") or [info]
+    total = 0
+    for fmt in formats:
+        size = fmt.get("filesize") or fmt.get("filesize_approx")
+        if not size:
+            # Estimate from bitrate (kbit/s) and duration when the size is not advertised.
+            tbr = fmt.get("tbr")
+            duration = info.get("duration")
+            if not (tbr and duration):
+                return None
+            size = tbr * 1000 / 8 * duration
+        total += size
+    return int(total)
+
+
+def remember_info(url, info):
+    """Keeps a raw (unprocessed) extraction of ``url`` for the download that follows."""
+    now = time.monotonic()
+    with _probed_lock:
+        for key, (stored_at, _) in list(_probed_info.items()):
+            if now - stored_at > PROBED_INFO_TTL_SECONDS:
+                del _probed_info[key]
+        while len(_probed_info) >= PROBED_INFO_MAX_ENTRIES:
+            del _probed_info[next(iter(_probed_info))]
+        _probed_info[url] = (now, info)
+
+
+def resolve_info(ydl, url):
+    """
+    Same as ydl.extract_info(url, download=False), but starts from a recent
+    raw extraction of the link (see remember_info) instead of hitting the
+    site again. Format selection still uses ``ydl``'s own options.
+    """
+    with _probed_lock:
+        stored_at, raw = _probed_info.pop(url, (0.0, None))
+    if raw is not None and time.monotonic() - stored_at <= PROBED_INFO_TTL_SECONDS:
+        return ydl.process_ie_result(raw, download=False)
+    return ydl.extract_info(url, download=False)
+
+
+def probe_and_download(ydl, url, info=None):
+    """
+    Resolves ``url`` without downloading, rejects it if the selected format is
+    over the size cap, and only then downloads the already-resolved formats.
+    An ``info`` dict already returned by extract_info(download=False) is reused.
+    Returns the processed info dict (suitable for ydl.prepare_filename).
+    """
+    if info is None:
+        info = resolve_info(ydl, url)
+    if info.get("_type") in ("playlist", "multi_video"):
+        entries = [entry for entry in info.get("entries") or [] if entry]
+    else:
+        entries = [info]
+
+    for entry in entries:
+        size = estimate_size(entry)
+        if size is not None and size > MAX_FILE_SIZE_BYTES:
+            logger.info(f"Rejecting {url}: probed size {size / (1024 * 1024):.2f}MB is over the limit")
+            raise FileTooLargeError(size)
+
+    return ydl.process_ie_result(info, download=True)
+
+
+def size_gate_opts():
+    """
+    yt-dlp options that refuse a download whose advertised size is over the
+    cap. Downloads without an advertised size are caught by size_guard.
+    """
+    return {"max_filesize": MAX_FILE_SIZE_BYTES}
+
+
+def size_guard(progress_hook=None):
+    """
+    Wraps a yt-dlp progress hook so the download is aborted with
+    FileTooLargeError as soon as the bytes actually written pass the cap.
+    max_filesize only checks the advertised size, which chunked,
+    unknown-length and fragmented downloads do not have. The files of one
+    job (e.g. the video and audio of a merged format) are added up.
+    """
+    written = {}
+
+    def hook(d):
+        if d['status'] in ('downloading', 'finished'):
+            written[d.get('filename')] = d.get('downloaded_bytes') or d.get('total_bytes') or 0
+            total = sum(written.values())
+            if total > MAX_FILE_SIZE_BYTES:
+                logger.info(f"Aborting download of {d.get('filename')}: {total / (1024 * 1024):.2f}MB written")
+                raise FileTooLargeError(total)
+        if progress_hook is not None:
+            progress_hook(d)
+
+    return hook
+
+
+def downloaded_file(path):
+    """
+    Returns ``path`` if the download really produced it. yt-dlp's HTTP
+    downloader gives up without raising (e.g. when max_filesize refuses the
+    file), which leaves prepare_filename pointing at nothing.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            "⚠️ لم يتم حفظ الملف، ربما لأنه أكبر من الحد المسموح | "
+            "The download produced no file, it may be over the size limit"
+        )
+    return path
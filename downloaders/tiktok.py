@@ -1,9 +1,15 @@
 import logging
 import os
-import yt_dlp
+
+from .probe import FileTooLargeError, downloaded_file, probe_and_download, size_gate_opts, size_guard, size_limited_format
+from .utils import DownloadCancelled
+from .ytdlp_pool import ytdlp_extractor
 
 logger = logging.getLogger(__name__)
 
+# Add user agent to avoid bot detection
+TIKTOK_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
 def download_tiktok_video(url, output_path="downloads", progress_callback=None):
     """
     Downloads a TikTok video using yt-dlp.
@@ -20,26 +26,27 @@ def download_tiktok_video(url, output_path="downloads", progress_callback=None):
                 total = d.get('total_bytes') or d.get('total_bytes_estimate')
                 downloaded = d.get('downloaded_bytes', 0)
                 if total:
-                    progress_callback(downloaded, total)
+                    progress_callback(downloaded, total, d.get('speed'), d.get('eta'))
 
     ydl_opts = {
-        'format': 'best[ext=mp4]/best',
+        'format': size_limited_format('best[ext=mp4]/best'),
         'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
         'quiet': True,
         'no_warnings': True,
-        'progress_hooks': [ytdlp_progress],
-        # Add user agent to avoid bot detection
-        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        **size_gate_opts(),
+        'user_agent': TIKTOK_USER_AGENT,
     }
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Extract info first
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
+        with ytdlp_extractor("tiktok", ydl_opts, size_guard(ytdlp_progress)) as ydl:
+            # Probe size first, then download the resolved format
+            info = probe_and_download(ydl, url)
+            filename = downloaded_file(ydl.prepare_filename(info))
             logger.info(f"TikTok download success: {filename}")
             return filename
             
+    except (FileTooLargeError, DownloadCancelled):
+        raise
     except Exception as e:
         logger.error(f"TikTok download failed: {e}")
         raise Exception(f"Failed to download TikTok video: {str(e)}")
@@ -1,9 +1,65 @@
+import functools
 import os
+import re
 import logging
 
 logger = logging.getLogger(__name__)
 
-MAX_FILE_SIZE_MB = 2000  # 2 GB - حد Telegram الأقصى
+# Uploads above 50 MB are only accepted by a self-hosted Bot API server (--local mode).
+BOT_API_LOCAL_MODE_ENABLED = os.getenv("BOT_API_LOCAL_MODE", "False").lower() == "true"
+MAX_FILE_SIZE_MB = int(os.getenv(
+    "MAX_FILE_SIZE_MB",
+    "2000" if BOT_API_LOCAL_MODE_ENABLED else "50",
+))  # 2 GB - حد Telegram الأقصى مع Local Bot API، و 50 MB مع السيرفر الرسمي
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+
+class DownloadCancelled(Exception):
+    """Raised from a progress callback to abort a download nobody wants any more."""
+
+
+_MEDIA_ID_PATTERNS = [
+    ("youtube", re.compile(r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([\w-]{11})", re.IGNORECASE)),
+    ("instagram", re.compile(r"instagram\.com/(?:p|reel|reels|tv)/([^/?#&]+)", re.IGNORECASE)),
+    ("twitter", re.compile(r"(?:twitter|x)\.com/[^/]+/status(?:es)?/(\d+)", re.IGNORECASE)),
+    ("tiktok", re.compile(r"tiktok\.com/.*?/video/(\d+)", re.IGNORECASE)),
+    ("facebook", re.compile(r"(?:facebook\.com/.*?(?:videos/|reel/|[?&]v=)|fb\.watch/)([\w-]+)", re.IGNORECASE)),
+]
+
+def normalize_url(url):
+    """Strips scheme, 'www.', fragments and trailing slashes so equivalent links compare equal."""
+    url = url.strip().split("#", 1)[0]
+    url = re.sub(r"^https?://", "", url, flags=re.IGNORECASE)
+    url = re.sub(r"^(?:www\.|m\.)", "", url, flags=re.IGNORECASE)
+    return url.rstrip("/")
+
+def detect_platform(url):
+    """Returns the platform name a link belongs to, or None if it is not supported."""
+    if "youtube.com" in url or "youtu.be" in url:
+        return "youtube"
+    if "instagram.com" in url:
+        return "instagram"
+    if "twitter.com" in url or "x.com" in url:
+        return "twitter"
+    if "facebook.com" in url or "fb.watch" in url:
+        return "facebook"
+    if "tiktok.com" in url:
+        return "tiktok"
+    return None
+
+def get_media_key(url):
+    """
+    Returns a canonical '<platform>:<media id>' key for a link, e.g.
+    'youtube:dQw4w9WgXcQ' or 'instagram:C1a2b3'. Links whose id cannot be
+    parsed without a network round-trip (short TikTok links etc.) fall
+    back to the normalized URL.
+    """
+    for platform, pattern in _MEDIA_ID_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return f"{platform}:{match.group(1)}"
+    return f"url:{normalize_url(url)}"
 
 def check_file_size(file_path):
     """Checks if the file size is within the limit."""
@@ -32,13 +88,25 @@ def cleanup_file(file_path):
     except OSError as e:
         logger.error(f"Error deleting file or directory {file_path}: {e}")
 
+@functools.lru_cache(maxsize=1)
+def get_cookies_path():
+    """
+    Returns the path of cookies.txt in the project root, or None if it does not exist.
+    Looked up once per process; restart the bot after adding or removing the file.
+    """
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cookies_path = os.path.join(base_dir, "cookies.txt")
+    if os.path.exists(cookies_path):
+        logger.info(f"Using cookies from: {cookies_path}")
+        return cookies_path
+    return None
+
 def get_ytdlp_opts(extra_opts=None):
     """
     Returns a base set of yt-dlp options with realistic User-Agent 
     and cookies support if cookies.txt exists.
     """
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    cookies_path = os.path.join(base_dir, "cookies.txt")
+    cookies_path = get_cookies_path()
     
     opts = {
         'quiet': True,
@@ -49,9 +117,8 @@ def get_ytdlp_opts(extra_opts=None):
         },
     }
     
-    if os.path.exists(cookies_path):
+    if cookies_path:
         opts['cookiefile'] = cookies_path
-        logger.info(f"Using cookies from: {cookies_path}")
     
     if extra_opts:
         opts.update(extra_opts)
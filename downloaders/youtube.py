@@ -1,70 +1,115 @@
 import logging
 import os
+import shutil
 from pytube import YouTube
-from pytube.exceptions import PytubeError
-import yt_dlp
 
-from .utils import get_ytdlp_opts
+from .utils import FFMPEG_BINARY, DownloadCancelled, get_ytdlp_opts
+from .probe import MAX_FILE_SIZE_BYTES, FileTooLargeError, downloaded_file, probe_and_download, resolve_info, size_gate_opts, size_guard, size_limited_format
+from .ytdlp_pool import ytdlp_extractor
+from .backends import BackendSkipped, run_backends
+from .dash import dash_opts, download_dash, select_dash_formats
 
 logger = logging.getLogger(__name__)
 
-def download_youtube_video(url, output_path="downloads", progress_callback=None):
-    """
-    Downloads a YouTube video using pytube, with a fallback to yt-dlp.
-    Returns the path to the downloaded file.
-    """
+# Download the best adaptive video + audio streams in parallel and mux them (needs ffmpeg)
+YOUTUBE_DASH_ENABLED = os.getenv("YOUTUBE_DASH", "True").lower() == "true"
+
+def _first_within_limit(streams):
+    """Returns the first stream whose size is within MAX_FILE_SIZE_MB, checked before downloading."""
+    for stream in streams:
+        try:
+            if stream.filesize <= MAX_FILE_SIZE_BYTES:
+                return stream
+        except Exception as e:
+            logger.debug(f"Could not determine size of stream {stream}: {e}")
+    return None
+
+def _download_with_pytube(url, output_path, progress_callback=None):
+    logger.info(f"Attempting download with pytube: {url}")
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    # Try pytube first
-    try:
-        logger.info(f"Attempting download with pytube: {url}")
-        
-        def pytube_progress(stream, chunk, bytes_remaining):
+    def pytube_progress(stream, chunk, bytes_remaining):
+        if progress_callback:
+            total_size = stream.filesize
+            bytes_downloaded = total_size - bytes_remaining
+            progress_callback(bytes_downloaded, total_size)
+
+    yt = YouTube(url, on_progress_callback=pytube_progress)
+    # Get highest resolution progressive stream (video+audio) that fits the size limit
+    stream = _first_within_limit(yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc())
+
+    if not stream:
+        # Fallback if no progressive stream found
+        stream = _first_within_limit(yt.streams.filter(file_extension='mp4').order_by('resolution').desc())
+
+    if not stream:
+        raise BackendSkipped("no mp4 stream within the size limit")
+    filename = stream.download(output_path)
+    logger.info(f"Pytube download success: {filename}")
+    return filename
+
+def _download_with_ytdlp(url, output_path, progress_callback=None):
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    def ytdlp_progress(d):
+        if d['status'] == 'downloading':
             if progress_callback:
-                total_size = stream.filesize
-                bytes_downloaded = total_size - bytes_remaining
-                progress_callback(bytes_downloaded, total_size)
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                downloaded = d.get('downloaded_bytes', 0)
+                if total:
+                    progress_callback(downloaded, total, d.get('speed'), d.get('eta'))
 
-        yt = YouTube(url, on_progress_callback=pytube_progress)
-        # Get highest resolution progressive stream (video+audio)
-        stream = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
-        
-        if not stream:
-            # Fallback if no progressive stream found
-            stream = yt.streams.filter(file_extension='mp4').order_by('resolution').desc().first()
-            
-        if stream:
-            filename = stream.download(output_path)
-            logger.info(f"Pytube download success: {filename}")
-            return filename
-    except Exception as e:
-        logger.warning(f"Pytube failed: {e}. Switching to yt-dlp.")
+    ydl_opts = get_ytdlp_opts({
+        **size_gate_opts(),
+        **dash_opts(),
+        'format': size_limited_format('best[ext=mp4]/best'),
+        'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
+    })
 
-    # Fallback to yt-dlp
     try:
-        def ytdlp_progress(d):
-            if d['status'] == 'downloading':
-                if progress_callback:
-                    total = d.get('total_bytes') or d.get('total_bytes_estimate')
-                    downloaded = d.get('downloaded_bytes', 0)
-                    if total:
-                        progress_callback(downloaded, total)
-
-        ydl_opts = get_ytdlp_opts({
-            'format': 'best[ext=mp4]/best',
-            'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
-            'progress_hooks': [ytdlp_progress],
-        })
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
+        with ytdlp_extractor("youtube", ydl_opts, size_guard(ytdlp_progress)) as ydl:
+            info = None
+            if YOUTUBE_DASH_ENABLED and shutil.which(FFMPEG_BINARY):
+                info = resolve_info(ydl, url)
+                pair = select_dash_formats(info)
+                if pair:
+                    video, audio = pair
+                    logger.info(f"Downloading DASH streams {video['format_id']}+{audio['format_id']} ({video.get('height')}p)")
+                    base_path = os.path.splitext(ydl.prepare_filename(info))[0]
+                    filename = download_dash("youtube", info, pair, base_path, ydl_opts, progress_callback)
+                    logger.info(f"yt-dlp DASH download success: {filename}")
+                    return filename
+            # No adaptive pair fits: the progressive format resolved above is used as-is.
+            info = probe_and_download(ydl, url, info)
+            filename = downloaded_file(ydl.prepare_filename(info))
             logger.info(f"yt-dlp download success: {filename}")
             return filename
+    except (FileTooLargeError, DownloadCancelled):
+        raise
     except Exception as e:
         logger.error(f"yt-dlp failed: {e}")
         err_msg = str(e).lower()
         if "sign in to confirm" in err_msg or "bot" in err_msg:
             raise Exception("YouTube is asking for verification. Please add your cookies.txt file to bypass this.")
         raise Exception(f"Failed to download YouTube video: {str(e)}")
+
+def download_youtube_video(url, output_path="downloads", progress_callback=None):
+    """
+    Downloads a YouTube video with pytube or yt-dlp, trying whichever has
+    recently been faster and more reliable first (see backends.run_backends).
+    With DASH enabled yt-dlp comes first, since pytube only handles
+    progressive streams (up to 720p).
+    Returns the path to the downloaded file.
+    """
+    backends = [("pytube", _download_with_pytube), ("yt-dlp", _download_with_ytdlp)]
+    if YOUTUBE_DASH_ENABLED:
+        backends.reverse()
+    return run_backends(
+        "youtube",
+        backends,
+        url,
+        output_path,
+        progress_callback,
+    )
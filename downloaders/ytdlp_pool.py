@@ -0,0 +1,171 @@
+import copy
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+# yt-dlp extractor keys to warm up for each platform, so the first request
+# does not pay for instantiating them.
+_PLATFORM_IES = {
+    "youtube": ("Youtube",),
+    "music": ("Youtube",),
+    "twitter": ("Twitter",),
+    "facebook": ("Facebook",),
+    "tiktok": ("TikTok", "TikTokVM"),
+}
+
+# Options that differ for every job (its download directory); they are set on
+# the checked-out instance instead of being part of the pool key.
+_PER_JOB_OPTS = ("outtmpl", "paths")
+
+
+class _PooledExtractor:
+    """A YoutubeDL instance whose progress hook can be swapped per job."""
+
+    def __init__(self, platform, opts):
+        self.hook = None
+        opts = {k: v for k, v in opts.items() if k not in _PER_JOB_OPTS}
+        opts["progress_hooks"] = [self._dispatch_progress]
+        self.ydl = yt_dlp.YoutubeDL(opts)
+        self._defaults = {k: copy.deepcopy(self.ydl.params.get(k)) for k in _PER_JOB_OPTS}
+        # Load the cookie jar and the platform's extractors up front.
+        _ = self.ydl.cookiejar
+        for ie_key in _PLATFORM_IES.get(platform, ()):
+            try:
+                self.ydl.get_info_extractor(ie_key)
+            except Exception:
+                pass
+
+    def bind(self, opts):
+        """Applies a job's per-job options, falling back to the instance's defaults."""
+        for k in _PER_JOB_OPTS:
+            value = opts[k] if k in opts else self._defaults[k]
+            if value is None:
+                self.ydl.params.pop(k, None)
+            else:
+                self.ydl.params[k] = copy.deepcopy(value)
+        self.ydl._parse_outtmpl()
+
+    def _dispatch_progress(self, d):
+        if self.hook is not None:
+            self.hook(d)
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logger.debug(f"Failed to close pooled YoutubeDL: {e}")
+
+
+class ExtractorPool:
+    """
+    Thread-safe pool of warm YoutubeDL instances keyed by platform and options.
+
+    An instance is used by one job at a time; it is returned to the pool after
+    a successful job and discarded after a failure, so a broken session never
+    leaks into the next request. At most ``max_idle`` instances are kept per key
+    and ``max_total_idle`` overall; beyond that the least recently used key
+    loses its oldest instance.
+    """
+
+    def __init__(self, max_idle=4, max_total_idle=16):
+        self.max_idle = max_idle
+        self.max_total_idle = max_total_idle
+        self._idle: "OrderedDict[tuple, deque]" = OrderedDict()
+        self._total_idle = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    @staticmethod
+    def _key(platform, opts):
+        shared = {k: v for k, v in opts.items() if k not in _PER_JOB_OPTS}
+        return platform, json.dumps(shared, sort_keys=True, default=str)
+
+    def _take_idle(self, key):
+        idle = self._idle.get(key)
+        if not idle:
+            return None
+        pooled = idle.popleft()
+        self._total_idle -= 1
+        if not idle:
+            del self._idle[key]
+        return pooled
+
+    def _put_idle(self, key, pooled) -> list:
+        """Returns ``pooled`` to the pool; returns the instances that have to be closed."""
+        idle = self._idle.setdefault(key, deque())
+        self._idle.move_to_end(key)
+        if len(idle) >= self.max_idle:
+            return [pooled]
+        idle.append(pooled)
+        self._total_idle += 1
+        evicted = []
+        while self._total_idle > self.max_total_idle:
+            lru_key, lru = next(iter(self._idle.items()))
+            evicted.append(lru.popleft())
+            self._total_idle -= 1
+            self.evicted += 1
+            if not lru:
+                del self._idle[lru_key]
+        return evicted
+
+    @contextmanager
+    def extractor(self, platform, opts, progress_hook=None):
+        """Checks out a YoutubeDL for ``platform`` with ``opts`` and attaches ``progress_hook``."""
+        key = self._key(platform, opts)
+        with self._lock:
+            pooled = self._take_idle(key)
+            if pooled is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if pooled is None:
+            pooled = _PooledExtractor(platform, opts)
+
+        pooled.hook = progress_hook
+        try:
+            pooled.bind(opts)
+            yield pooled.ydl
+        except BaseException:
+            pooled.close()
+            raise
+        pooled.hook = None
+
+        with self._lock:
+            to_close = self._put_idle(key, pooled)
+        for extra in to_close:
+            extra.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "keys": len(self._idle),
+                "idle": self._total_idle,
+                "created": self.created,
+                "reused": self.reused,
+                "evicted": self.evicted,
+            }
+
+    def close(self):
+        with self._lock:
+            pools = list(self._idle.values())
+            self._idle.clear()
+            self._total_idle = 0
+        for idle in pools:
+            for pooled in idle:
+                pooled.close()
+
+
+_POOL = ExtractorPool()
+
+
+def ytdlp_extractor(platform, opts, progress_hook=None):
+    """Context manager returning a pooled YoutubeDL; see ExtractorPool.extractor."""
+    return _POOL.extractor(platform, opts, progress_hook)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Minimal stand-in for the Telegram Bot API, for trying the bot locally
+without touching api.telegram.org.
+
+Run it, then start the bot with BOT_API_URL pointing at it:
+
+    python fake_bot_api.py --port 8081
+    BOT_API_URL=http://127.0.0.1:8081 WEBHOOK_URL=http://127.0.0.1:8443/telegram python bot.py
+
+Every API call is recorded and logged. Updates can be pushed to the
+registered webhook with FakeBotAPI.deliver_update(), which sends the
+secret token header exactly like Telegram does.
+
+Like a real `telegram-bot-api --local` server it also accepts file:// paths
+for media, reading the file from disk, so local mode can be tried with
+BOT_API_LOCAL_MODE=true.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+# Media parameter of each send method and the key of the object Telegram returns for it.
+MEDIA_PARAMS = {
+    "sendVideo": "video",
+    "sendPhoto": "photo",
+    "sendAudio": "audio",
+    "sendDocument": "document",
+    "sendAnimation": "animation",
+}
+
+BOT_USER = {
+    "id": 1000000001,
+    "is_bot": True,
+    "first_name": "Fake Bot",
+    "username": "fake_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+class FakeBotAPI:
+    """Threaded HTTP server answering Bot API methods with canned responses."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081):
+        self.calls: list[tuple[str, dict]] = []
+        # Bytes received per media parameter: ("upload", n) for multipart, ("local", n) for file:// paths.
+        self.media_received: list[tuple[str, int]] = []
+        self.webhook_url = ""
+        self.webhook_secret = None
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def methods_called(self) -> list[str]:
+        with self._lock:
+            return [method for method, _ in self.calls]
+
+    def deliver_update(self, update: dict, secret_token: str | None = None) -> int:
+        """POSTs an update to the registered webhook and returns the HTTP status."""
+        if not self.webhook_url:
+            raise RuntimeError("No webhook registered")
+        headers = {"Content-Type": "application/json"}
+        token = self.webhook_secret if secret_token is None else secret_token
+        if token:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = token
+        request = urllib.request.Request(self.webhook_url, data=json.dumps(update).encode(), headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def _fake_message(self, method: str, params: dict) -> dict:
+        chat_id = params.get("chat_id", 1)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        message_id = next(self._message_ids)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        kind = MEDIA_PARAMS.get(method)
+        if kind is None:
+            message["text"] = params.get("text", "")
+            return message
+
+        file = {"file_id": f"fake-{kind}-{message_id}", "file_unique_id": f"u{message_id}"}
+        if kind == "photo":
+            message["photo"] = [dict(file, width=1280, height=720)]
+        elif kind in ("video", "animation"):
+            message[kind] = dict(file, width=1280, height=720, duration=1)
+        elif kind == "audio":
+            message["audio"] = dict(file, duration=1)
+        else:
+            message["document"] = file
+        return message
+
+    def _read_local_file(self, uri: str) -> int:
+        """Reads a file:// media path the way a local Bot API server would."""
+        path = unquote(urlparse(uri).path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        size = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                size += len(chunk)
+        return size
+
+    def _handle(self, method: str, params: dict):
+        with self._lock:
+            self.calls.append((method, params))
+        logger.info(f"{method} {params}")
+
+        if method == "getMe":
+            return BOT_USER
+        if method == "setWebhook":
+            self.webhook_url = params.get("url", "")
+            self.webhook_secret = params.get("secret_token")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = ""
+            self.webhook_secret = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "getUpdates":
+            # Long polling against the fake server just idles.
+            time.sleep(min(float(params.get("timeout", 0) or 0), 1.0))
+            return []
+        if method == "sendMediaGroup":
+            items = params.get("media", [])
+            if isinstance(items, str):
+                items = json.loads(items)
+            send_methods = {kind: method for method, kind in MEDIA_PARAMS.items()}
+            return [self._fake_message(send_methods.get(item.get("type"), "sendDocument"), params) for item in items]
+        media_param = MEDIA_PARAMS.get(method)
+        if media_param is not None:
+            value = params.get(media_param)
+            if isinstance(value, str) and value.startswith("file://"):
+                self.media_received.append(("local", self._read_local_file(value)))
+            elif isinstance(value, dict):
+                self.media_received.append(("upload", value["_bytes"]))
+        if method.startswith("send") or method.startswith("edit"):
+            return self._fake_message(method, params)
+        return True
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                content_type = self.headers.get("Content-Type", "")
+                if "application/json" in content_type and body:
+                    params = json.loads(body)
+                elif "application/x-www-form-urlencoded" in content_type:
+                    params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+                elif "multipart/form-data" in content_type:
+                    params = _parse_multipart(content_type, body)
+                else:
+                    params = {}
+
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                try:
+                    payload = {"ok": True, "result": api._handle(method, params)}
+                    status = 200
+                except FileNotFoundError as e:
+                    payload = {"ok": False, "error_code": 400, "description": f"Bad Request: file not found: {e}"}
+                    status = 400
+                payload = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _parse_multipart(content_type: str, body: bytes) -> dict:
+    """Parses a multipart/form-data body; file parts are summarised by their size."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    params = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        if part.get_filename():
+            params[name] = {"_bytes": len(payload), "filename": part.get_filename()}
+        else:
+            params[name] = payload.decode("utf-8", errors="replace")
+    return params
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    server = FakeBotAPI(args.host, args.port).start()
+    print(f"Fake Bot API listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Literal, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CachedFile:
+    kind: Literal["video", "photo", "audio", "document"]
+    file_id: str
+    stored_at: float
+
+
+class FileIdCache:
+    """Persistent store of Telegram file_ids keyed by canonical media id.
+
+    Once Telegram has accepted an upload it returns a file_id that can be
+    resent to any chat without uploading the bytes again. Entries expire
+    after ``ttl_seconds`` and the least recently used ones are evicted once
+    ``max_entries`` is reached. The store is a small JSON file so it
+    survives restarts; changes are batched and written atomically by a
+    background thread at most every ``flush_delay`` seconds, and ``flush``
+    writes whatever is pending (call it on shutdown).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: float = 30 * 24 * 3600,
+        max_entries: int = 10000,
+        flush_delay: float = 5.0,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.flush_delay = flush_delay
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes writers so an older snapshot never replaces a newer one.
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load file_id cache from {self.path}: {e}")
+            return
+
+        now = time.time()
+        # Entries are stored oldest-first, which is also the LRU order.
+        for key, value in raw.items():
+            try:
+                entry = CachedFile(kind=value["kind"], file_id=value["file_id"], stored_at=float(value["stored_at"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if now - entry.stored_at < self.ttl_seconds:
+                self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        logger.info(f"Loaded {len(self._entries)} cached file_ids from {self.path}")
+
+    def _schedule_save(self):
+        """Marks the store dirty and starts the flush timer; called with ``_lock`` held."""
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Writes pending changes to disk; blocking, so keep it off the event loop."""
+        with self._save_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = {
+                    key: {"kind": e.kind, "file_id": e.file_id, "stored_at": e.stored_at}
+                    for key, e in self._entries.items()
+                }
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Failed to persist file_id cache: {e}")
+
+    def get(self, key: str) -> Optional[CachedFile]:
+        """Returns the cached file for ``key`` or None, updating hit/miss counters."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry.stored_at >= self.ttl_seconds:
+                del self._entries[key]
+                self._schedule_save()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            # The file keeps entries in LRU order, so a hit is a change worth persisting.
+            self._schedule_save()
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, kind: str, file_id: str):
+        """Stores a file_id, evicting the least recently used entries if full."""
+        with self._lock:
+            self._entries[key] = CachedFile(kind=kind, file_id=file_id, stored_at=time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._schedule_save()
+
+    def invalidate(self, key: str):
+        """Drops an entry, e.g. when Telegram no longer accepts its file_id."""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._schedule_save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
@@ -0,0 +1,265 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Optional
+
+from telegram import InputFile
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Lower value = dispatched first.
+PRIORITY_DELIVERY = 0
+PRIORITY_STATUS = 1
+
+# Edits whose older, not yet sent versions may be dropped in favour of the newest one.
+_SUPERSEDABLE = {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+
+class TokenBucket:
+    """Classic token bucket; ``blocked_until`` additionally holds it closed after a 429."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        """Seconds until ``cost`` tokens can be taken (0 if they can be taken now)."""
+        self._refill(now)
+        # A request costing more than the whole bucket may go once the bucket is full.
+        needed = min(cost, self.capacity)
+        wait = 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def consume(self, cost: float = 1):
+        self.tokens -= cost
+
+    def block(self, now: float, seconds: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+@dataclass(order=True)
+class _Pending:
+    priority: int
+    seq: int
+    chat_id: Any = field(compare=False)
+    cost: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    edit_key: Optional[tuple] = field(compare=False, default=None)
+
+
+def _retry_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def _is_group(chat_id) -> bool:
+    try:
+        return int(chat_id) < 0
+    except (TypeError, ValueError):
+        # @channelusername
+        return True
+
+
+def _rewind_uploads(data: dict) -> list:
+    """
+    Rewinds streamed uploads so a retried request sends the whole file again.
+    Handles that were closed in the meantime are reopened; the reopened
+    handles are returned so the caller can close them.
+    """
+    reopened = []
+    for value in data.values():
+        items = value if isinstance(value, (list, tuple)) else [value]
+        for item in items:
+            for candidate in (item, getattr(item, "media", None), getattr(item, "thumbnail", None)):
+                if not isinstance(candidate, InputFile):
+                    continue
+                handle = candidate.input_file_content
+                if not hasattr(handle, "seek"):
+                    continue
+                if getattr(handle, "closed", False):
+                    candidate.input_file_content = open(handle.name, "rb")
+                    reopened.append(candidate.input_file_content)
+                else:
+                    handle.seek(0)
+    return reopened
+
+
+class FloodControl(BaseRateLimiter[int]):
+    """
+    Outbound dispatcher for every Bot API call that targets a chat.
+
+    Requests wait for a token from the bot-wide bucket and from their chat's
+    bucket (private chats and groups have different limits). Deliveries
+    (send*) go before status edits and deletes; a status edit that is still
+    queued when a newer edit of the same message arrives is dropped. A
+    RetryAfter closes the chat's bucket for the requested time and the request
+    is retried, rewinding any streamed uploads first.
+
+    Calls without a chat (getMe, setWebhook, answerCallbackQuery, ...) and
+    getUpdates are not throttled. ``rate_limit_args`` may carry an explicit
+    priority.
+    """
+
+    def __init__(
+        self,
+        overall_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20 / 60,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+    ):
+        self.overall = TokenBucket(overall_rate, overall_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chats: dict[Any, TokenBucket] = {}
+        self._queue: list[_Pending] = []
+        self._edits: dict[tuple, _Pending] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.superseded = 0
+        self.retries = 0
+
+    async def initialize(self) -> None:
+        # ExtBot.initialize runs once for the Application and once for the Updater.
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for pending in self._queue:
+            if not pending.future.done():
+                pending.future.cancel()
+        self._queue.clear()
+        self._edits.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if _is_group(chat_id) else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _prune_chats(self, now: float):
+        if len(self._chats) < 1000:
+            return
+        busy = {pending.chat_id for pending in self._queue}
+        for chat_id in [c for c, b in self._chats.items() if c not in busy and b.idle(now)]:
+            del self._chats[chat_id]
+
+    async def _acquire(self, chat_id, cost: int, priority: int, edit_key: Optional[tuple]) -> bool:
+        """Waits for this request's turn. Returns False if a newer edit superseded it."""
+        future = asyncio.get_running_loop().create_future()
+        pending = _Pending(priority, next(self._seq), chat_id, cost, future, edit_key)
+        if edit_key is not None:
+            previous = self._edits.get(edit_key)
+            if previous is not None and not previous.future.done():
+                previous.future.set_result(False)
+                self.superseded += 1
+            self._edits[edit_key] = pending
+        heapq.heappush(self._queue, pending)
+        self._wakeup.set()
+        try:
+            return await future
+        finally:
+            if edit_key is not None and self._edits.get(edit_key) is pending:
+                del self._edits[edit_key]
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            next_wake = None
+            deferred = []
+            while self._queue:
+                pending = heapq.heappop(self._queue)
+                if pending.future.done():
+                    continue
+                overall_wait = self.overall.wait_time(now, pending.cost)
+                if overall_wait > 0:
+                    # Nothing may overtake the highest-priority request for the global budget.
+                    deferred.append(pending)
+                    next_wake = overall_wait
+                    break
+                chat_wait = self._chat_bucket(pending.chat_id).wait_time(now, pending.cost)
+                if chat_wait > 0:
+                    deferred.append(pending)
+                    next_wake = chat_wait if next_wake is None else min(next_wake, chat_wait)
+                    continue
+                self.overall.consume(pending.cost)
+                self._chats[pending.chat_id].consume(pending.cost)
+                pending.future.set_result(True)
+            for pending in deferred:
+                heapq.heappush(self._queue, pending)
+            self._prune_chats(now)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_wake)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None or self._task is None:
+            return await callback(*args, **kwargs)
+
+        if rate_limit_args is not None:
+            priority = rate_limit_args
+        elif endpoint.startswith("send"):
+            priority = PRIORITY_DELIVERY
+        else:
+            priority = PRIORITY_STATUS
+        edit_key = None
+        if endpoint in _SUPERSEDABLE and data.get("message_id") is not None:
+            edit_key = (endpoint, chat_id, data["message_id"])
+        # Every item of an album counts as a message.
+        cost = len(data["media"]) if endpoint == "sendMediaGroup" else 1
+
+        reopened = []
+        try:
+            for attempt in range(self.max_retries + 1):
+                if not await self._acquire(chat_id, cost, priority, edit_key):
+                    # A newer edit of the same message replaces this one.
+                    return True
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = _retry_seconds(e)
+                    self.retries += 1
+                    logger.warning(f"Flood control: {endpoint} to {chat_id} retried after {delay:.0f}s")
+                    self._chat_bucket(chat_id).block(time.monotonic(), delay)
+                    reopened.extend(_rewind_uploads(data))
+        finally:
+            for handle in reopened:
+                handle.close()
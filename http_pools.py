@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+logger = logging.getLogger(__name__)
+
+# Bot API methods that carry media (or return it) and may hold a connection for minutes
+BULK_ENDPOINTS = frozenset({
+    "sendPhoto", "sendVideo", "sendAudio", "sendDocument", "sendAnimation",
+    "sendVoice", "sendVideoNote", "sendMediaGroup", "sendSticker", "editMessageMedia",
+})
+# Waiting longer than this for a free connection is logged
+SLOW_POOL_WAIT_SECONDS = 1.0
+
+
+class PoolStats:
+    """Counts requests of one pool and how long they waited for a free connection."""
+
+    def __init__(self):
+        self.requests = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.pool_timeouts = 0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.requests += 1
+            if seconds > 0.001:
+                self.waited += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.pool_timeouts += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "waited": self.waited,
+                "mean_wait": (self.total_wait / self.requests) if self.requests else 0.0,
+                "max_wait": self.max_wait,
+                "pool_timeouts": self.pool_timeouts,
+            }
+
+
+class MeteredHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest that measures how long each request waits for a connection.
+
+    Requests are admitted through a semaphore the size of the connection
+    pool, so the time spent acquiring it is the pool wait and a request that
+    cannot get a connection within ``pool_timeout`` fails the same way an
+    httpx pool timeout would.
+    """
+
+    def __init__(self, name: str, connection_pool_size: int, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        self.name = name
+        self.pool_size = connection_pool_size
+        self.pool_stats = PoolStats()
+        self._connections = asyncio.Semaphore(connection_pool_size)
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> tuple[int, bytes]:
+        if pool_timeout is BaseRequest.DEFAULT_NONE:
+            pool_timeout = self._client.timeout.pool
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._connections.acquire(), timeout=pool_timeout)
+        except asyncio.TimeoutError:
+            self.pool_stats.record_timeout()
+            raise TimedOut(
+                f"No free connection in the {self.name} pool ({self.pool_size}) after {pool_timeout:g}s"
+            ) from None
+        waited = time.monotonic() - started
+        self.pool_stats.record_wait(waited)
+        if waited >= SLOW_POOL_WAIT_SECONDS:
+            logger.warning(f"Waited {waited:.1f}s for a connection in the {self.name} pool")
+        try:
+            return await super().do_request(
+                url,
+                method,
+                request_data=request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout,
+            )
+        finally:
+            self._connections.release()
+
+
+class RoutingRequest(BaseRequest):
+    """
+    Sends media uploads (and file downloads) through a ``bulk`` pool and every
+    other Bot API call through a ``control`` pool, so a long upload never
+    holds the connection a status edit or button answer needs.
+    """
+
+    def __init__(self, control: MeteredHTTPXRequest, bulk: MeteredHTTPXRequest):
+        self.control = control
+        self.bulk = bulk
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.control.read_timeout
+
+    async def initialize(self) -> None:
+        await self.control.initialize()
+        await self.bulk.initialize()
+
+    async def shutdown(self) -> None:
+        await self.control.shutdown()
+        await self.bulk.shutdown()
+
+    def _route(self, url: str, request_data: Optional[RequestData]) -> MeteredHTTPXRequest:
+        endpoint = url.rsplit("/", 1)[-1]
+        if endpoint in BULK_ENDPOINTS or "/file/bot" in url or (request_data and request_data.contains_files):
+            return self.bulk
+        return self.control
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> tuple[int, bytes]:
+        return await self._route(url, request_data).do_request(
+            url,
+            method,
+            request_data=request_data,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            connect_timeout=connect_timeout,
+            pool_timeout=pool_timeout,
+        )
+
+
+def pool_stats(*requests: MeteredHTTPXRequest) -> dict:
+    """Pool-wait metrics keyed by pool name."""
+    return {request.name: request.pool_stats.stats() for request in requests}
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+BAR_LENGTH = 15
+
+
+def _format_bytes(size: float) -> str:
+    if size < 1024:
+        return f"{int(size)} B"
+    for unit in ("KB", "MB"):
+        size /= 1024
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} GB"
+
+
+def _format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    minutes, secs = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def _bar(done: float, total: float) -> str:
+    percentage = (done / total) * 100
+    filled_length = int(BAR_LENGTH * done // total)
+    bar = '█' * filled_length + '░' * (BAR_LENGTH - filled_length)
+    return f"[{bar}] {percentage:.1f}%"
+
+
+def render_progress(downloaded: int, total: int, speed: Optional[float] = None, eta: Optional[float] = None) -> str:
+    """Builds the status text for a download in progress."""
+    if not total or total <= 0:
+        return "⬇️ جاري التحميل... | Downloading..."
+
+    downloaded = min(downloaded, total)
+    text = f"⬇️ جاري التحميل... | Downloading...\n{_bar(downloaded, total)}"
+
+    details = [f"📦 {_format_bytes(downloaded)} / {_format_bytes(total)}"]
+    if speed:
+        details.append(f"🚀 {_format_bytes(speed)}/s")
+    if eta is not None and eta >= 0:
+        details.append(f"⏳ {_format_eta(eta)}")
+    return text + "\n" + " • ".join(details)
+
+
+def render_encode_progress(processed: float, total: float, speed: Optional[float] = None, eta: Optional[float] = None) -> str:
+    """Builds the status text for watermarking; progress is in seconds of video."""
+    if not total or total <= 0:
+        return "🖼️ جاري إضافة العلامة المائية... | Adding watermark..."
+
+    processed = min(processed, total)
+    text = f"🖼️ جاري إضافة العلامة المائية... | Adding watermark...\n{_bar(processed, total)}"
+    details = []
+    if speed:
+        details.append(f"⚡ {speed:.1f}x")
+    if eta is not None and eta >= 0:
+        details.append(f"⏳ {_format_eta(eta)}")
+    return text + ("\n" + " • ".join(details) if details else "")
+
+
+_KEEP_MARKUP = object()
+
+
+class StatusMessage:
+    """
+    A job's status message. Edits keep its inline keyboard (e.g. a Cancel
+    button) unless another ``reply_markup`` is given, and once the message
+    is closed further edits are dropped, so work that outlives the job (a
+    download shared with other chats) cannot overwrite the final text.
+    """
+
+    def __init__(self, message, reply_markup=None):
+        self.message = message
+        self.reply_markup = reply_markup
+        self.closed = False
+
+    async def edit_text(self, text, reply_markup=_KEEP_MARKUP, **kwargs):
+        if self.closed:
+            return None
+        if reply_markup is _KEEP_MARKUP:
+            reply_markup = self.reply_markup
+        return await self.message.edit_text(text, reply_markup=reply_markup, **kwargs)
+
+    async def close(self, text: str):
+        """Shows the job's final text without the keyboard and ignores later edits."""
+        if self.closed:
+            return
+        self.closed = True
+        await self.message.edit_text(text)
+
+    async def delete(self):
+        self.closed = True
+        return await self.message.delete()
+
+
+class ProgressTracker:
+    """Latest progress of one job; written from download threads, read by the service."""
+
+    def __init__(self, service: "ProgressService", status_msg, render=render_progress):
+        self.status_msg = status_msg
+        self.render = render
+        self._service = service
+        self._lock = threading.Lock()
+        self._state: Optional[tuple] = None
+        self._dirty = False
+        self._last_text: Optional[str] = None
+        self._finished = False
+        self._edit_lock = asyncio.Lock()
+        self._last_edit = 0.0
+        # Used to derive speed/ETA when the downloader does not report them (e.g. pytube).
+        self._first_sample: Optional[tuple[float, int]] = None
+
+    def update(self, downloaded: int, total: int, speed: Optional[float] = None, eta: Optional[float] = None):
+        """Progress callback for downloaders; cheap and safe to call from any thread."""
+        now = time.monotonic()
+        with self._lock:
+            if self._finished:
+                return
+            if self._first_sample is None:
+                self._first_sample = (now, downloaded)
+            if speed is None:
+                started, start_bytes = self._first_sample
+                elapsed = now - started
+                if elapsed > 1 and downloaded > start_bytes:
+                    speed = (downloaded - start_bytes) / elapsed
+            if eta is None and speed and total:
+                eta = max(0, (total - downloaded) / speed)
+            self._state = (downloaded, total, speed, eta)
+            self._dirty = True
+
+    def _take(self) -> Optional[tuple]:
+        with self._lock:
+            if not self._dirty or self._finished:
+                return None
+            self._dirty = False
+            return self._state
+
+    async def finish(self):
+        """Stops progress edits; waits for an in-flight edit so later status edits are not overwritten."""
+        with self._lock:
+            self._finished = True
+        async with self._edit_lock:
+            pass
+        self._service._discard(self)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+
+class ProgressService:
+    """
+    Collects progress from every job and turns it into status-message edits.
+
+    Edits share a bot-wide budget of ``edits_per_second`` so progress never
+    crowds out real replies: the more jobs are running, the less often each
+    one is refreshed (but never more often than every ``min_interval``
+    seconds). Edits that would not change the text are skipped.
+    """
+
+    def __init__(self, edits_per_second: float = 5.0, min_interval: float = 2.0, tick: float = 0.25):
+        self.edits_per_second = edits_per_second
+        self.min_interval = min_interval
+        self.tick = tick
+        self._trackers: list[ProgressTracker] = []
+        self._task: Optional[asyncio.Task] = None
+        self._tokens = edits_per_second
+        self.edits_sent = 0
+        self.edits_skipped = 0
+
+    def track(self, status_msg, render=render_progress) -> ProgressTracker:
+        tracker = ProgressTracker(self, status_msg, render)
+        self._trackers.append(tracker)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return tracker
+
+    def _discard(self, tracker: ProgressTracker):
+        if tracker in self._trackers:
+            self._trackers.remove(tracker)
+
+    def interval(self) -> float:
+        """Per-job refresh interval that keeps all jobs together within the budget."""
+        return max(self.min_interval, len(self._trackers) / self.edits_per_second)
+
+    async def _run(self):
+        last = time.monotonic()
+        while self._trackers:
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            self._tokens = min(self.edits_per_second, self._tokens + (now - last) * self.edits_per_second)
+            last = now
+
+            interval = self.interval()
+            due = [t for t in self._trackers if now - t._last_edit >= interval and not t._edit_lock.locked()]
+            # Jobs that waited longest go first.
+            due.sort(key=lambda t: t._last_edit)
+            for tracker in due:
+                if self._tokens < 1:
+                    break
+                state = tracker._take()
+                if state is None:
+                    continue
+                text = tracker.render(*state)
+                if text == tracker._last_text:
+                    self.edits_skipped += 1
+                    continue
+                self._tokens -= 1
+                tracker._last_edit = now
+                asyncio.create_task(self._edit(tracker, text))
+
+    async def _edit(self, tracker: ProgressTracker, text: str):
+        async with tracker._edit_lock:
+            if tracker.finished:
+                return
+            try:
+                await tracker.status_msg.edit_text(text)
+                tracker._last_text = text
+                self.edits_sent += 1
+            except Exception as e:
+                logger.debug(f"Progress edit failed: {e}")
@@ -0,0 +1,360 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Hashable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PLATFORMS = ("youtube", "instagram", "twitter", "facebook", "tiktok")
+THREAD_STAGES = ("resolve", "probe", "download")
+FAST_LANE = "fast"
+BULK_LANE = "bulk"
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class QueueFullError(Exception):
+    """Raised when the scheduler already holds the maximum number of queued jobs."""
+
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    lane: str
+    tag: float
+    on_position: Optional[PositionCallback] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    position: int = 0
+
+
+class _FairQueue:
+    """One lane's waiters, in start-time fair queueing order across owners.
+
+    Every job gets a virtual start tag: the later of the lane's virtual time
+    and the finish tag of its owner's previous job, where a job "lasts"
+    ``1 / weight``. Waiters are served by start tag (FIFO on ties), so an
+    owner with many queued jobs is interleaved with everybody else instead
+    of running them back to back. Jobs without an owner are never held back.
+    """
+
+    def __init__(self):
+        self.waiters: list[_Waiter] = []
+        self.vtime = 0.0
+        self._finish: dict[Hashable, float] = {}
+
+    def tag(self, owner: Optional[Hashable], weight: float) -> float:
+        start = max(self.vtime, self._finish.get(owner, 0.0)) if owner is not None else self.vtime
+        if owner is not None:
+            self._finish[owner] = start + 1 / weight
+        return start
+
+    def started(self, tag: float):
+        """Advances the virtual time to the start tag of a job that just got its slot."""
+        if tag <= self.vtime:
+            return
+        self.vtime = tag
+        # Owners whose share is used up by now start from the virtual time like everybody else.
+        for owner in [o for o, finish in self._finish.items() if finish <= tag]:
+            del self._finish[owner]
+
+    def push(self, waiter: _Waiter):
+        index = len(self.waiters)
+        while index and self.waiters[index - 1].tag > waiter.tag:
+            index -= 1
+        self.waiters.insert(index, waiter)
+
+    def popleft(self) -> _Waiter:
+        return self.waiters.pop(0)
+
+    def oldest(self) -> _Waiter:
+        return min(self.waiters, key=lambda waiter: waiter.enqueued_at)
+
+    def remove(self, waiter: _Waiter):
+        self.waiters.remove(waiter)
+
+    def __contains__(self, waiter: _Waiter) -> bool:
+        return waiter in self.waiters
+
+    def __iter__(self) -> Iterator[_Waiter]:
+        return iter(self.waiters)
+
+    def __len__(self) -> int:
+        return len(self.waiters)
+
+
+@dataclass
+class _PlatformQueue:
+    limit: int
+    active: int = 0
+    bulk_active: int = 0
+    fast: _FairQueue = field(default_factory=_FairQueue)
+    bulk: _FairQueue = field(default_factory=_FairQueue)
+
+    def lane(self, lane: str) -> _FairQueue:
+        return self.fast if lane == FAST_LANE else self.bulk
+
+    def waiting(self) -> int:
+        return len(self.fast) + len(self.bulk)
+
+
+class JobScheduler:
+    """Central scheduler for download jobs.
+
+    Every job first takes a slot for its platform; at most ``platform_limits[p]``
+    jobs per platform run at once and at most ``max_queued`` jobs wait for a slot
+    across all platforms. Waiters are told their queue position whenever it
+    changes.
+
+    Each job runs in a lane. Small jobs (photos, short clips) go in the fast
+    lane and are served before bulk jobs; bulk jobs may only use
+    ``limit - fast_reserved`` of a platform's slots, so a few slots are
+    always left for fast jobs. Within a lane jobs are shared fairly between
+    their owners (users), weighted by the weight each job is queued with, and
+    a bulk job that has waited ``aging_seconds`` goes ahead of fast jobs so it
+    cannot starve.
+
+    Blocking work runs on a dedicated thread pool per stage (resolve, lane
+    probes, download) so a burst of downloads cannot starve metadata lookups.
+    Post-processing (ffmpeg subprocesses driven with asyncio) and uploads are
+    bounded by their own limits.
+    """
+
+    def __init__(
+        self,
+        platform_limits: dict[str, int],
+        max_queued: int = 50,
+        stage_workers: Optional[dict[str, int]] = None,
+        upload_limit: int = 4,
+        default_limit: int = 2,
+        fast_reserved: int = 1,
+        aging_seconds: float = 120,
+        fast_max_bytes: int = 20 * 1024 * 1024,
+        fast_max_seconds: float = 180,
+    ):
+        self.max_queued = max_queued
+        self.fast_reserved = max(0, fast_reserved)
+        self.aging_seconds = aging_seconds
+        self.fast_max_bytes = fast_max_bytes
+        self.fast_max_seconds = fast_max_seconds
+        self._default_limit = max(1, default_limit)
+        self._queues: dict[str, _PlatformQueue] = {
+            platform: _PlatformQueue(limit=max(1, limit)) for platform, limit in platform_limits.items()
+        }
+        stage_workers = stage_workers or {}
+        total_slots = sum(q.limit for q in self._queues.values()) or self._default_limit
+        defaults = {"resolve": 4, "probe": 2, "download": total_slots, "postprocess": 2}
+        self._executors = {
+            stage: ThreadPoolExecutor(
+                max_workers=max(1, stage_workers.get(stage, defaults[stage])),
+                thread_name_prefix=f"{stage}-worker",
+            )
+            for stage in THREAD_STAGES
+        }
+        self._postprocess_slots = asyncio.Semaphore(max(1, stage_workers.get("postprocess", defaults["postprocess"])))
+        self._upload_slots = asyncio.Semaphore(max(1, upload_limit))
+        self.queue_full = 0
+
+    def _queue(self, platform: str) -> _PlatformQueue:
+        if platform not in self._queues:
+            self._queues[platform] = _PlatformQueue(limit=self._default_limit)
+        return self._queues[platform]
+
+    def queued_jobs(self) -> int:
+        return sum(q.waiting() for q in self._queues.values())
+
+    def active_jobs(self) -> int:
+        return sum(q.active for q in self._queues.values())
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active_jobs(),
+            "queued": self.queued_jobs(),
+            "queue_full": self.queue_full,
+        }
+
+    def has_free_slot(self, platform: str) -> bool:
+        """True if a new job for ``platform`` would start right away, whatever its lane."""
+        queue = self._queue(platform)
+        return self._can_start(queue, BULK_LANE) and not queue.waiting()
+
+    def check_capacity(self, platform: str):
+        """Raises QueueFullError if a new job for ``platform`` could neither start nor wait."""
+        queue = self._queue(platform)
+        if queue.active >= queue.limit and self.queued_jobs() >= self.max_queued:
+            self.queue_full += 1
+            raise QueueFullError(f"Job queue is full ({self.max_queued} waiting)")
+
+    def lane_for(self, size_bytes: Optional[int], duration: Optional[float], default: str = BULK_LANE) -> str:
+        """Picks the lane for a job from its expected size and duration.
+
+        A job goes in the fast lane only if nothing known about it exceeds the
+        fast-lane thresholds; if neither is known, ``default`` is used.
+        """
+        if size_bytes is None and duration is None:
+            return default
+        if size_bytes is not None and size_bytes > self.fast_max_bytes:
+            return BULK_LANE
+        if duration is not None and duration > self.fast_max_seconds:
+            return BULK_LANE
+        return FAST_LANE
+
+    def _bulk_limit(self, queue: _PlatformQueue) -> int:
+        # A platform with a single slot cannot reserve it; bulk jobs still need to run.
+        return max(1, queue.limit - self.fast_reserved)
+
+    def _can_start(self, queue: _PlatformQueue, lane: str) -> bool:
+        if queue.active >= queue.limit:
+            return False
+        return lane == FAST_LANE or queue.bulk_active < self._bulk_limit(queue)
+
+    def _admit(self, queue: _PlatformQueue, lane: str):
+        queue.active += 1
+        if lane == BULK_LANE:
+            queue.bulk_active += 1
+
+    def _next_waiter(self, queue: _PlatformQueue) -> Optional[_Waiter]:
+        """Picks the waiter to start next: an aged bulk job, then fast jobs, then bulk jobs."""
+        bulk_ready = bool(queue.bulk) and self._can_start(queue, BULK_LANE)
+        if bulk_ready:
+            oldest = queue.bulk.oldest()
+            if time.monotonic() - oldest.enqueued_at >= self.aging_seconds:
+                queue.bulk.remove(oldest)
+                return oldest
+        if queue.fast and self._can_start(queue, FAST_LANE):
+            return queue.fast.popleft()
+        if bulk_ready:
+            return queue.bulk.popleft()
+        return None
+
+    def _dispatch(self, queue: _PlatformQueue):
+        """Starts as many waiters as the free slots allow, then updates everyone's position."""
+        while True:
+            waiter = self._next_waiter(queue)
+            if waiter is None:
+                break
+            if waiter.future.done():
+                continue
+            queue.lane(waiter.lane).started(waiter.tag)
+            self._admit(queue, waiter.lane)
+            waiter.future.set_result(None)
+        self._notify_positions(queue)
+
+    def _notify_positions(self, queue: _PlatformQueue):
+        """Tells waiters whose position changed about it; fast-lane waiters are ahead of bulk ones."""
+        for position, waiter in enumerate([*queue.fast, *queue.bulk], start=1):
+            if waiter.position == position:
+                continue
+            waiter.position = position
+            if waiter.on_position is not None:
+                asyncio.create_task(_safe_call(waiter.on_position, position))
+
+    async def _acquire(
+        self,
+        platform: str,
+        lane: str,
+        on_position: Optional[PositionCallback],
+        owner: Optional[Hashable],
+        weight: float,
+    ):
+        queue = self._queue(platform)
+        waiting = queue.lane(lane)
+        if self._can_start(queue, lane) and not waiting:
+            waiting.started(waiting.tag(owner, weight))
+            self._admit(queue, lane)
+            return
+
+        if self.queued_jobs() >= self.max_queued:
+            self.queue_full += 1
+            raise QueueFullError(f"Job queue is full ({self.max_queued} waiting)")
+
+        waiter = _Waiter(
+            future=asyncio.get_running_loop().create_future(),
+            lane=lane,
+            tag=waiting.tag(owner, weight),
+            on_position=on_position,
+        )
+        waiting.push(waiter)
+        self._notify_positions(queue)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in waiting:
+                waiting.remove(waiter)
+                self._notify_positions(queue)
+            elif waiter.future.done() and not waiter.future.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on.
+                self._release(platform, lane)
+            raise
+
+    def _release(self, platform: str, lane: str):
+        queue = self._queue(platform)
+        queue.active -= 1
+        if lane == BULK_LANE:
+            queue.bulk_active -= 1
+        self._dispatch(queue)
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        platform: str,
+        on_position: Optional[PositionCallback] = None,
+        lane: str = BULK_LANE,
+        owner: Optional[Hashable] = None,
+        weight: float = 1.0,
+    ):
+        """Holds one of the platform's job slots in ``lane`` for the duration of the block.
+
+        ``owner`` (e.g. a user id) and ``weight`` decide the job's fair share
+        of the lane while it waits. Raises QueueFullError immediately if the
+        job would have to wait and the queue is already full.
+        """
+        await self._acquire(platform, lane, on_position, owner, max(weight, 0.01))
+        try:
+            yield
+        finally:
+            self._release(platform, lane)
+
+    async def run(self, stage: str, func, *args, **kwargs):
+        """
+        Runs a blocking function on the executor dedicated to ``stage``.
+
+        A thread cannot be interrupted, so if the caller is cancelled this
+        still waits for ``func`` to return (jobs stop at their next progress
+        update) before the cancellation propagates; callers can then safely
+        remove the files it was writing.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executors[stage], functools.partial(func, *args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            with contextlib.suppress(Exception):
+                await future
+            raise
+
+    @contextlib.asynccontextmanager
+    async def postprocess_slot(self):
+        """Bounds the number of concurrent post-processing jobs (ffmpeg remuxes and thumbnails)."""
+        async with self._postprocess_slots:
+            yield
+
+    @contextlib.asynccontextmanager
+    async def upload_slot(self):
+        """Bounds the number of concurrent uploads to Telegram."""
+        async with self._upload_slots:
+            yield
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _safe_call(callback: PositionCallback, position: int):
+    try:
+        await callback(position)
+    except Exception as e:
+        logger.debug(f"Queue position callback failed: {e}")
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[..., None]
+
+
+class Flight:
+    """One in-progress download shared by every chat that asked for the same media.
+
+    The leader starts the job (the producer) and every consumer, the leader
+    included, subscribes to its progress and awaits the same result. The
+    files in the result are reference counted by the registry and only
+    cleaned up once the last consumer has released the flight; if every
+    consumer leaves before the job is done, the job is abandoned.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.refs = 0
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._subscribers: list[ProgressCallback] = []
+        self._lock = threading.Lock()
+        self._last_progress: Optional[tuple] = None
+        self.producer: Optional[asyncio.Task] = None
+        # Set once nobody wants the result; checked by the producer's worker threads.
+        self.abandoned = threading.Event()
+        # Set by the leader once it has delivered the result, so followers can
+        # reuse that delivery (e.g. a freshly cached file_id) instead of repeating it.
+        self.delivered = asyncio.Event()
+
+    def subscribe(self, callback: ProgressCallback):
+        with self._lock:
+            self._subscribers.append(callback)
+            last = self._last_progress
+        # Late joiners immediately see how far the download already is.
+        if last is not None:
+            callback(*last)
+
+    def publish_progress(self, downloaded: int, total: int, *extra):
+        """Progress hook for the producer's download; safe to call from worker threads."""
+        progress = (downloaded, total, *extra)
+        with self._lock:
+            self._last_progress = progress
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(*progress)
+            except Exception as e:
+                logger.debug(f"Progress subscriber for {self.key} failed: {e}")
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def successful_result(self):
+        """Returns the result if the flight completed successfully, otherwise None."""
+        if not self._future.done() or self._future.cancelled() or self._future.exception() is not None:
+            return None
+        return self._future.result()
+
+    def set_result(self, result):
+        if not self._future.done():
+            self._future.set_result(result)
+
+    def set_exception(self, exc: BaseException):
+        if isinstance(exc, asyncio.CancelledError):
+            # Followers were not cancelled themselves; give them a normal error to report.
+            exc = Exception("The download was cancelled")
+        if not self._future.done():
+            self._future.set_exception(exc)
+            # Mark the exception as retrieved for flights nobody else waits on.
+            self._future.exception()
+
+    async def wait(self):
+        return await asyncio.shield(self._future)
+
+
+class SingleFlight:
+    """Registry of in-flight downloads keyed by canonical media key.
+
+    ``cleanup`` is called with a flight's result once its last consumer has
+    released it, so a file is never deleted while another chat is still
+    uploading it. It runs on a worker thread, since removing files blocks.
+    """
+
+    def __init__(self, cleanup: Callable[[object], None]):
+        self._cleanup = cleanup
+        self._flights: dict[str, Flight] = {}
+
+    def start(self, flight: Flight, produce: Callable[[], Awaitable]):
+        """Runs the flight's job as its own task, so consumers can leave without stopping it for the others."""
+
+        async def run():
+            try:
+                result = await produce()
+            except BaseException as e:
+                self.fail(flight, e)
+                return
+            flight.set_result(result)
+            if flight.refs <= 0:
+                # Everyone left while the job was finishing.
+                self._cleanup_result(flight)
+
+        flight.producer = asyncio.create_task(run())
+
+    def join(self, key: str) -> tuple[Flight, bool]:
+        """Returns the flight for ``key`` and whether the caller is its leader."""
+        flight = self._flights.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = Flight(key)
+            self._flights[key] = flight
+        else:
+            logger.info(f"Joining in-flight download for {key} ({flight.refs} already waiting)")
+        flight.refs += 1
+        return flight, is_leader
+
+    def fail(self, flight: Flight, exc: BaseException):
+        """Fails a flight for all consumers and lets new requests start a fresh one."""
+        flight.set_exception(exc)
+        flight.delivered.set()
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def release(self, flight: Flight):
+        flight.refs -= 1
+        if flight.refs > 0:
+            return
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        if not flight.done():
+            logger.info(f"Abandoning download for {flight.key}: nobody is waiting for it any more")
+            flight.abandoned.set()
+            if flight.producer is not None:
+                flight.producer.cancel()
+            return
+        self._cleanup_result(flight)
+
+    def _cleanup_result(self, flight: Flight):
+        result = flight.successful_result()
+        if result is not None:
+            asyncio.get_running_loop().run_in_executor(None, self._run_cleanup, flight.key, result)
+
+    def _run_cleanup(self, key: str, result):
+        try:
+            self._cleanup(result)
+        except Exception as e:
+            logger.error(f"Cleanup for {key} failed: {e}")
+
+    def __len__(self):
+        return len(self._flights)
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StorageFullError(Exception):
+    """Raised when the downloads quota is used up by running or recently used jobs and nothing can be evicted."""
+
+
+@dataclass
+class StorageJob:
+    """A job's private working directory; everything the job writes lives under ``path``."""
+
+    path: str
+    root: str
+    created_at: float
+
+
+def _entry_size(path: str) -> int:
+    if os.path.isfile(path) or os.path.islink(path):
+        try:
+            return os.lstat(path).st_size
+        except OSError:
+            return 0
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _last_used(path: str) -> float:
+    """Most recent mtime of an entry or anything inside it."""
+    latest = 0.0
+    try:
+        latest = os.stat(path).st_mtime
+    except OSError:
+        return latest
+    if os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in dirnames + filenames:
+                try:
+                    latest = max(latest, os.lstat(os.path.join(dirpath, name)).st_mtime)
+                except OSError:
+                    pass
+    return latest
+
+
+def _remove(path: str):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Error deleting {path}: {e}")
+
+
+class DownloadStorage:
+    """
+    Owns the downloads directory.
+
+    Every job works in its own subdirectory, so releasing a job removes
+    everything it left behind (yt-dlp .part and merge leftovers, per-post
+    folders, watermarked copies) and any entry that no running job holds and
+    that nothing has touched for ``orphan_age`` seconds is an orphan. The age
+    matters when several instances share the directory: another instance's
+    running jobs keep writing, so they are never taken for orphans. Before a
+    job starts, the least recently used orphans are evicted until usage is
+    under ``quota_bytes``; if running and recently used entries alone use the
+    quota, StorageFullError is raised. Orphans are also swept at startup and
+    every ``sweep_interval`` seconds.
+
+    When ``tmpfs_root`` is set and every file a job may produce is small
+    (``max_file_bytes`` <= ``tmpfs_max_file_bytes``), the job is placed on
+    that RAM-backed path as long as it has room for a few such files.
+    """
+
+    def __init__(
+        self,
+        root: str = "downloads",
+        quota_bytes: int = 0,
+        max_file_bytes: int = 0,
+        tmpfs_root: Optional[str] = None,
+        tmpfs_max_file_bytes: int = 50 * 1024 * 1024,
+        orphan_age: float = 600.0,
+        sweep_interval: float = 600.0,
+    ):
+        self.root = os.path.abspath(root)
+        self.quota_bytes = quota_bytes
+        self.max_file_bytes = max_file_bytes
+        self.tmpfs_root = os.path.abspath(tmpfs_root) if tmpfs_root else None
+        self.tmpfs_max_file_bytes = tmpfs_max_file_bytes
+        self.orphan_age = orphan_age
+        self.sweep_interval = sweep_interval
+        self._jobs: dict[str, StorageJob] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.evicted_bytes = 0
+        os.makedirs(self.root, exist_ok=True)
+        if self.tmpfs_root:
+            os.makedirs(self.tmpfs_root, exist_ok=True)
+
+    def _roots(self) -> list[str]:
+        return [self.root] + ([self.tmpfs_root] if self.tmpfs_root else [])
+
+    def _use_tmpfs(self) -> bool:
+        if not self.tmpfs_root or not self.max_file_bytes:
+            return False
+        if self.max_file_bytes > self.tmpfs_max_file_bytes:
+            return False
+        # Room for the download, its merge/.part leftovers and a watermarked copy.
+        try:
+            return shutil.disk_usage(self.tmpfs_root).free >= 3 * self.max_file_bytes
+        except OSError:
+            return False
+
+    def usage(self) -> int:
+        """Bytes currently used under the (disk) downloads root."""
+        return _entry_size(self.root)
+
+    def open_job(self, name: str = "job") -> StorageJob:
+        """Creates a working directory for a new job, evicting orphans to stay under the quota."""
+        root = self.tmpfs_root if self._use_tmpfs() else self.root
+        with self._lock:
+            if root == self.root and self.quota_bytes:
+                usage = self._evict_until(self.quota_bytes)
+                if usage >= self.quota_bytes:
+                    raise StorageFullError(
+                        f"Downloads quota in use by running or recent jobs ({usage / (1024 * 1024):.0f}MB "
+                        f">= {self.quota_bytes / (1024 * 1024):.0f}MB)"
+                    )
+            path = tempfile.mkdtemp(prefix=f"{name}-", dir=root)
+            job = StorageJob(path=path, root=root, created_at=time.time())
+            self._jobs[path] = job
+        return job
+
+    def release(self, job: StorageJob):
+        """Removes a job's directory and everything in it."""
+        with self._lock:
+            self._jobs.pop(job.path, None)
+        _remove(job.path)
+
+    def job_for(self, file_path: str) -> Optional[StorageJob]:
+        """Returns the running job whose directory contains ``file_path``."""
+        path = os.path.abspath(file_path)
+        with self._lock:
+            for job_path, job in self._jobs.items():
+                if os.path.commonpath([path, job_path]) == job_path:
+                    return job
+        return None
+
+    def release_path(self, file_path: str) -> bool:
+        """Releases the job owning ``file_path``; False if no job owns it."""
+        job = self.job_for(file_path)
+        if job is None:
+            return False
+        self.release(job)
+        return True
+
+    def _orphans(self, min_age: float) -> list[tuple[float, str]]:
+        """(last used, path) of top-level entries no running job holds, oldest first."""
+        now = time.time()
+        orphans = []
+        for root in self._roots():
+            try:
+                names = os.listdir(root)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(root, name)
+                if path in self._jobs:
+                    continue
+                last_used = _last_used(path)
+                if now - last_used >= min_age:
+                    orphans.append((last_used, path))
+        orphans.sort()
+        return orphans
+
+    def _evict_until(self, limit: int) -> int:
+        """Evicts least recently used orphans until disk usage is below ``limit``; returns usage."""
+        usage = self.usage()
+        if usage < limit:
+            return usage
+        for _, path in self._orphans(self.orphan_age):
+            if usage < limit:
+                break
+            if not path.startswith(self.root + os.sep):
+                continue
+            size = _entry_size(path)
+            _remove(path)
+            usage -= size
+            self.evicted_bytes += size
+            logger.info(f"Evicted {path} ({size / (1024 * 1024):.2f}MB) to stay under the downloads quota")
+        return usage
+
+    def sweep(self, min_age: Optional[float] = None) -> int:
+        """Removes orphans older than ``min_age`` (default ``orphan_age``); returns bytes freed."""
+        freed = 0
+        with self._lock:
+            for _, path in self._orphans(self.orphan_age if min_age is None else min_age):
+                size = _entry_size(path)
+                _remove(path)
+                freed += size
+            if self.quota_bytes:
+                self._evict_until(self.quota_bytes)
+        if freed:
+            logger.info(f"Swept orphaned downloads: freed {freed / (1024 * 1024):.2f}MB")
+        return freed
+
+    async def start(self):
+        """Sweeps what previous runs left behind, then keeps sweeping in the background."""
+        await asyncio.to_thread(self.sweep)
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Downloads sweep failed: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import struct
+from dataclasses import dataclass
+from typing import Optional
+
+from watermark import FFMPEG_BINARY, probe_codecs, probe_video
+
+logger = logging.getLogger(__name__)
+
+# Containers whose index (moov atom) can be moved to the front with a stream copy
+FASTSTART_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+# Containers Telegram does not play inline; rewrapped as MP4 when their codecs allow a stream copy
+REMUX_TO_MP4_EXTENSIONS = ('.mkv', '.webm')
+MP4_VIDEO_CODECS = {'h264', 'hevc', 'av1', 'mpeg4'}
+MP4_AUDIO_CODECS = {'aac', 'mp3', 'ac3', 'eac3'}
+# Telegram ignores thumbnails larger than 320px on either side or 200KB
+THUMBNAIL_MAX_SIDE = 320
+
+
+@dataclass
+class VideoAttributes:
+    """What Telegram needs to show a video as playable before it is downloaded."""
+
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration: Optional[float] = None
+    thumbnail: Optional[str] = None
+
+
+def is_faststart(video_path):
+    """
+    True if the MP4's moov atom comes before its mdat, so players can start
+    without reading the whole file. Only the top-level box headers are read.
+    """
+    with open(video_path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size, box_type = struct.unpack('>I4s', header)
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat':
+                return False
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0] - 16
+            elif size == 0:
+                return False
+            else:
+                size -= 8
+            if size < 0:
+                return False
+            f.seek(size, os.SEEK_CUR)
+
+
+async def _run_ffmpeg(command):
+    """
+    Runs ffmpeg as an asyncio subprocess and returns (returncode, stderr).
+    If the caller is cancelled, ffmpeg is killed before the cancellation
+    propagates, so nothing writes into the job's files afterwards.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    return process.returncode, stderr.decode(errors="replace")
+
+
+async def remux_faststart(video_path):
+    """Rewrites an MP4 in place with the moov atom first, copying the streams without re-encoding."""
+    base, ext = os.path.splitext(video_path)
+    temp_path = base + "_faststart" + ext
+    command = [
+        FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+        "-i", video_path,
+        "-map", "0", "-c", "copy",
+        "-movflags", "+faststart",
+        temp_path,
+    ]
+    try:
+        returncode, stderr = await _run_ffmpeg(command)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise RuntimeError(f"ffmpeg remux failed with code {returncode}: {stderr.strip()[-500:]}")
+    os.replace(temp_path, video_path)
+    return video_path
+
+
+async def remux_to_mp4(video_path):
+    """
+    Rewraps an MKV/WebM as a faststart MP4 next to it, copying the streams
+    without re-encoding. Returns the new path, or None if the codecs cannot go
+    into MP4 as they are or ffmpeg fails; the original file is left alone.
+    """
+    video_codec, audio_codec = await asyncio.to_thread(probe_codecs, video_path)
+    if video_codec not in MP4_VIDEO_CODECS or (audio_codec is not None and audio_codec not in MP4_AUDIO_CODECS):
+        logger.info(f"Not remuxing {os.path.basename(video_path)} to MP4: codecs {video_codec}/{audio_codec}")
+        return None
+    output_path = os.path.splitext(video_path)[0] + ".mp4"
+    command = [
+        FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+        "-i", video_path,
+        # Subtitle and attachment streams of an MKV have no MP4 equivalent.
+        "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+        "-movflags", "+faststart",
+        output_path,
+    ]
+    try:
+        returncode, stderr = await _run_ffmpeg(command)
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    if returncode != 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        logger.warning(f"Remuxing {video_path} to MP4 failed with code {returncode}: {stderr.strip()[-300:]}")
+        return None
+    return output_path
+
+
+async def extract_thumbnail(video_path, duration=None):
+    """
+    Grabs a keyframe about 10% into the video as a small JPEG. The input-side
+    seek jumps straight to the keyframe before that point and, without
+    accurate seeking, that keyframe is the frame taken, so only one frame is
+    decoded however long the video is. Returns the path, or None.
+    """
+    thumbnail_path = os.path.splitext(video_path)[0] + "_thumb.jpg"
+    position = duration / 10 if duration else 0
+    scale = (
+        f"scale='min({THUMBNAIL_MAX_SIDE},iw)':'min({THUMBNAIL_MAX_SIDE},ih)'"
+        ":force_original_aspect_ratio=decrease"
+    )
+    command = [
+        FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+        "-noaccurate_seek", "-ss", f"{position:.3f}",
+        "-i", video_path,
+        "-map", "0:v:0", "-frames:v", "1",
+        "-vf", scale, "-q:v", "5",
+        thumbnail_path,
+    ]
+    returncode, stderr = await _run_ffmpeg(command)
+    if returncode != 0 or not os.path.exists(thumbnail_path):
+        logger.warning(f"Thumbnail extraction failed for {video_path}: {stderr.strip()[-300:]}")
+        return None
+    return thumbnail_path
+
+
+async def prepare_for_streaming(video_path):
+    """
+    Makes a downloaded video start playing instantly in Telegram clients:
+    MP4s with the index at the end are remuxed to faststart, MKV/WebM files
+    with MP4-compatible codecs are rewrapped as faststart MP4s (both stream
+    copies), and the dimensions, duration and a keyframe thumbnail are
+    collected for the upload. Returns (path, VideoAttributes), where path is
+    the file to upload; steps that fail are left out.
+    """
+    attributes = VideoAttributes()
+    if video_path.lower().endswith(REMUX_TO_MP4_EXTENSIONS):
+        try:
+            remuxed_path = await remux_to_mp4(video_path)
+            if remuxed_path:
+                logger.info(f"Remuxed {os.path.basename(video_path)} to MP4")
+                video_path = remuxed_path
+        except Exception as e:
+            logger.warning(f"MP4 remux failed for {video_path}: {e}")
+    elif video_path.lower().endswith(FASTSTART_EXTENSIONS):
+        try:
+            if not await asyncio.to_thread(is_faststart, video_path):
+                await remux_faststart(video_path)
+                logger.info(f"Remuxed {os.path.basename(video_path)} to faststart")
+        except Exception as e:
+            logger.warning(f"Faststart remux failed for {video_path}: {e}")
+
+    try:
+        attributes.width, attributes.height, attributes.duration = await asyncio.to_thread(probe_video, video_path)
+    except Exception as e:
+        logger.warning(f"ffprobe failed for {video_path}: {e}")
+    attributes.thumbnail = await extract_thumbnail(video_path, attributes.duration)
+    return video_path, attributes
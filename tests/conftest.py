@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# bot.py reads its configuration at import time; keep its files out of the checkout.
+_STATE_DIR = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ.setdefault("BOT_TOKEN", "123456:test-token")
+os.environ.setdefault("DOWNLOADS_DIR", os.path.join(_STATE_DIR, "downloads"))
+os.environ.setdefault("FILE_ID_CACHE_PATH", os.path.join(_STATE_DIR, "file_id_cache.json"))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+
+@pytest.fixture
+def fake_api():
+    api = FakeBotAPI(port=0).start()
+    yield api
+    api.stop()
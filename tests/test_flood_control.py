@@ -0,0 +1,104 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from telegram.error import RetryAfter
+
+from flood_control import FloodControl
+
+
+def _run(scenario, limiter: FloodControl):
+    async def wrapper():
+        await limiter.initialize()
+        try:
+            return await scenario()
+        finally:
+            await limiter.shutdown()
+
+    return asyncio.run(wrapper())
+
+
+def test_retry_after_blocks_chat_and_retries():
+    limiter = FloodControl(chat_rate=100, chat_burst=10, max_retries=2)
+    attempts = []
+
+    async def send():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RetryAfter(timedelta(seconds=0.2))
+        return "sent"
+
+    async def scenario():
+        return await limiter.process_request(send, (), {}, "sendMessage", {"chat_id": 7}, None)
+
+    assert _run(scenario, limiter) == "sent"
+    assert len(attempts) == 2
+    assert limiter.retries == 1
+    # The retry waited for the chat's bucket to reopen.
+    assert attempts[1] - attempts[0] >= 0.2
+
+
+def test_retry_after_gives_up_after_max_retries():
+    limiter = FloodControl(chat_rate=100, chat_burst=10, max_retries=1)
+    attempts = []
+
+    async def send():
+        attempts.append(None)
+        raise RetryAfter(timedelta(seconds=0.01))
+
+    async def scenario():
+        return await limiter.process_request(send, (), {}, "sendMessage", {"chat_id": 7}, None)
+
+    with pytest.raises(RetryAfter):
+        _run(scenario, limiter)
+    assert len(attempts) == 2
+
+
+def test_newer_edit_supersedes_queued_one():
+    limiter = FloodControl(chat_rate=5, chat_burst=1)
+    sent = []
+
+    def edit(text):
+        async def call():
+            sent.append(text)
+            return text
+
+        return limiter.process_request(
+            call, (), {}, "editMessageText", {"chat_id": 7, "message_id": 1, "text": text}, None
+        )
+
+    async def scenario():
+        # The first edit takes the chat's only token; the next two have to wait.
+        first = await edit("10%")
+        stale = asyncio.create_task(edit("20%"))
+        await asyncio.sleep(0)
+        latest = asyncio.create_task(edit("30%"))
+        return first, await stale, await latest
+
+    first, stale, latest = _run(scenario, limiter)
+    assert (first, stale, latest) == ("10%", True, "30%")
+    assert sent == ["10%", "30%"]
+    assert limiter.superseded == 1
+
+
+def test_deliveries_go_before_status_edits():
+    limiter = FloodControl(chat_rate=20, chat_burst=1)
+    sent = []
+
+    def request(endpoint, message_id=None):
+        async def call():
+            sent.append(endpoint)
+
+        data = {"chat_id": 7, "message_id": message_id}
+        return limiter.process_request(call, (), {}, endpoint, data, None)
+
+    async def scenario():
+        await request("sendMessage")
+        edit = asyncio.create_task(request("editMessageText", 1))
+        await asyncio.sleep(0)
+        delivery = asyncio.create_task(request("sendVideo"))
+        await asyncio.gather(edit, delivery)
+
+    _run(scenario, limiter)
+    assert sent == ["sendMessage", "sendVideo", "editMessageText"]
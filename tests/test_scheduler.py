@@ -0,0 +1,65 @@
+import asyncio
+
+from scheduler import FAST_LANE, JobScheduler, _FairQueue, _Waiter
+
+
+def _drain(queue: _FairQueue, jobs) -> list[str]:
+    names = {}
+    for name, owner, weight in jobs:
+        waiter = _Waiter(future=None, lane=FAST_LANE, tag=queue.tag(owner, weight))
+        names[id(waiter)] = name
+        queue.push(waiter)
+    order = []
+    while queue:
+        waiter = queue.popleft()
+        queue.started(waiter.tag)
+        order.append(names[id(waiter)])
+    return order
+
+
+def test_fair_queue_interleaves_owners():
+    jobs = [("a1", "a", 1.0), ("a2", "a", 1.0), ("a3", "a", 1.0), ("b1", "b", 1.0), ("b2", "b", 1.0)]
+    assert _drain(_FairQueue(), jobs) == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_fair_queue_honours_weight():
+    jobs = [("a1", "a", 2.0), ("a2", "a", 2.0), ("a3", "a", 2.0), ("b1", "b", 1.0), ("b2", "b", 1.0)]
+    # "a" gets two turns for every turn of "b".
+    assert _drain(_FairQueue(), jobs) == ["a1", "b1", "a2", "a3", "b2"]
+
+
+def test_fair_queue_never_holds_back_ownerless_jobs():
+    jobs = [("a1", "a", 1.0), ("a2", "a", 1.0), ("x", None, 1.0)]
+    assert _drain(_FairQueue(), jobs) == ["a1", "x", "a2"]
+
+
+def test_scheduler_grants_slots_in_fair_order():
+    scheduler = JobScheduler(platform_limits={"youtube": 1}, max_queued=10)
+
+    async def scenario():
+        order = []
+        release = asyncio.Event()
+
+        async def job(name, owner):
+            async with scheduler.slot("youtube", lane=FAST_LANE, owner=owner):
+                order.append(name)
+
+        async def holder():
+            async with scheduler.slot("youtube", lane=FAST_LANE):
+                await release.wait()
+
+        blocking = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        tasks = []
+        for name, owner in [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b")]:
+            tasks.append(asyncio.create_task(job(name, owner)))
+            await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 4
+        release.set()
+        await asyncio.gather(blocking, *tasks)
+        return order
+
+    try:
+        assert asyncio.run(scenario()) == ["a1", "b1", "a2", "a3"]
+    finally:
+        scheduler.shutdown()
@@ -0,0 +1,106 @@
+import asyncio
+
+from singleflight import SingleFlight
+
+
+async def _settle(cleaned: list, expected: int):
+    # Cleanup runs on a worker thread.
+    for _ in range(100):
+        if len(cleaned) >= expected:
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_follower_keeps_flight_alive_after_leader_leaves():
+    cleaned = []
+    registry = SingleFlight(cleanup=cleaned.append)
+
+    async def scenario():
+        finish = asyncio.Event()
+
+        async def produce():
+            await finish.wait()
+            return ["video.mp4"]
+
+        leader, is_leader = registry.join("yt:abc")
+        registry.start(leader, produce)
+        follower, follower_is_leader = registry.join("yt:abc")
+        assert (is_leader, follower_is_leader, follower is leader) == (True, False, True)
+
+        registry.release(leader)
+        assert not leader.abandoned.is_set()
+        finish.set()
+        result = await follower.wait()
+        assert cleaned == []
+
+        registry.release(follower)
+        await _settle(cleaned, 1)
+        return result
+
+    assert asyncio.run(scenario()) == ["video.mp4"]
+    assert cleaned == [["video.mp4"]]
+    assert len(registry) == 0
+
+
+def test_flight_is_abandoned_when_everyone_leaves():
+    cleaned = []
+    registry = SingleFlight(cleanup=cleaned.append)
+
+    async def scenario():
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def produce():
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return ["never.mp4"]
+
+        leader, _ = registry.join("yt:abc")
+        registry.start(leader, produce)
+        follower, _ = registry.join("yt:abc")
+        await started.wait()
+
+        registry.release(follower)
+        assert not leader.abandoned.is_set()
+        registry.release(leader)
+        assert leader.abandoned.is_set()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+        # A new request for the same media starts a fresh flight.
+        fresh, is_leader = registry.join("yt:abc")
+        assert is_leader and fresh is not leader
+        registry.release(fresh)
+
+    asyncio.run(scenario())
+    assert cleaned == []
+
+
+def test_result_finished_after_everyone_left_is_cleaned_up():
+    cleaned = []
+    registry = SingleFlight(cleanup=cleaned.append)
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def produce():
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                # A job past its last cancellation point still hands back its files.
+                return ["late.mp4"]
+
+        leader, _ = registry.join("yt:abc")
+        registry.start(leader, produce)
+        await started.wait()
+        registry.release(leader)
+        assert leader.abandoned.is_set()
+        await leader.producer
+        await _settle(cleaned, 1)
+
+    asyncio.run(scenario())
+    assert cleaned == [["late.mp4"]]
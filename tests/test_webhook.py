@@ -0,0 +1,71 @@
+import asyncio
+import socket
+import time
+
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+import bot
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _text_update(update_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+def test_webhook_round_trip(fake_api, monkeypatch):
+    port = _free_port()
+    monkeypatch.setattr(bot, "WEBHOOK_URL", f"http://127.0.0.1:{port}/telegram")
+    monkeypatch.setattr(bot, "WEBHOOK_LISTEN", "127.0.0.1")
+    monkeypatch.setattr(bot, "WEBHOOK_PORT", port)
+    monkeypatch.setattr(bot, "WEBHOOK_SECRET", "s3cret")
+
+    async def scenario():
+        application = ApplicationBuilder().token(bot.TOKEN).base_url(f"{fake_api.url}/bot").build()
+        received = []
+
+        async def echo(update, context):
+            received.append(update.message.text)
+            await update.message.reply_text(f"echo: {update.message.text}")
+
+        application.add_handler(MessageHandler(filters.TEXT, echo))
+        async with application:
+            await application.start()
+            await bot.start_webhook(application)
+            try:
+                assert fake_api.webhook_url == bot.WEBHOOK_URL
+                assert fake_api.webhook_secret == "s3cret"
+
+                accepted = await asyncio.to_thread(fake_api.deliver_update, _text_update(1, "hello"))
+                rejected = await asyncio.to_thread(
+                    fake_api.deliver_update, _text_update(2, "intruder"), "wrong-secret"
+                )
+                for _ in range(100):
+                    if "sendMessage" in fake_api.methods_called():
+                        break
+                    await asyncio.sleep(0.05)
+            finally:
+                await application.updater.stop()
+                await application.stop()
+        return accepted, rejected, received
+
+    accepted, rejected, received = asyncio.run(scenario())
+
+    assert accepted == 200
+    assert rejected == 403
+    assert received == ["hello"]
+    replies = [params for method, params in fake_api.calls if method == "sendMessage"]
+    assert [params["text"] for params in replies] == ["echo: hello"]
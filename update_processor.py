@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class _ChatLane:
+    """Serializes one chat's updates; asyncio.Lock hands itself over in FIFO order."""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+
+
+def _chat_key(update: object) -> Optional[int]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    # e.g. callback queries on inline messages carry no chat
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different chats concurrently, at most
+    ``max_concurrent_updates`` handlers at a time, while updates of the same
+    chat run one after another in the order Telegram delivered them.
+
+    An update waiting for its chat's earlier updates does not take one of the
+    ``max_concurrent_updates`` slots, so one busy chat cannot starve the
+    others. At most ``max_pending_updates`` updates are held (running or
+    waiting); PTB keeps any beyond that in its update queue.
+    """
+
+    def __init__(self, max_concurrent_updates: int = 32, max_pending_updates: int = 1024):
+        # The base class semaphore only bounds admitted updates; _active bounds running handlers.
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.active_limit = max_concurrent_updates
+        self._active = asyncio.Semaphore(max_concurrent_updates)
+        self._lanes: dict[int, _ChatLane] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat = _chat_key(update)
+        if chat is None:
+            async with self._active:
+                await coroutine
+            return
+
+        lane = self._lanes.get(chat)
+        if lane is None:
+            lane = self._lanes[chat] = _ChatLane()
+        lane.waiting += 1
+        try:
+            async with lane.lock:
+                async with self._active:
+                    await coroutine
+        finally:
+            lane.waiting -= 1
+            if not lane.waiting:
+                del self._lanes[chat]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,113 @@
+import logging
+import time
+from typing import Iterable
+
+from flood_control import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class UserLimitError(Exception):
+    """Raised when a user may not start another job right now."""
+
+
+class UserRateLimited(UserLimitError):
+    """The user sent links faster than their token bucket refills."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class UserQueueFull(UserLimitError):
+    """The user already has the maximum number of jobs queued or running."""
+
+    def __init__(self, pending: int):
+        super().__init__(f"{pending} jobs already pending")
+        self.pending = pending
+
+
+class UserLimiter:
+    """
+    Inbound admission control per user.
+
+    Every link costs a token from the user's bucket (``rate_per_minute``
+    tokens per minute, up to ``burst`` at once), and a user may have at most
+    ``max_pending`` jobs queued or running. Users on the admin allowlist are
+    exempt from both and get ``admin_weight`` times the normal share of the
+    job queue. Rejections are counted for ``stats()``.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float = 10.0,
+        burst: float = 5.0,
+        max_pending: int = 3,
+        admins: Iterable[int] = (),
+        admin_weight: float = 2.0,
+    ):
+        self.rate = rate_per_minute / 60
+        self.burst = max(1.0, burst)
+        self.max_pending = max(1, max_pending)
+        self.admins = frozenset(admins)
+        self.admin_weight = admin_weight
+        self._buckets: dict[int, TokenBucket] = {}
+        self._pending: dict[int, int] = {}
+        self.rate_limited = 0
+        self.queue_capped = 0
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admins
+
+    def weight(self, user_id: int) -> float:
+        """The user's weight in the scheduler's fair queueing."""
+        return self.admin_weight if self.is_admin(user_id) else 1.0
+
+    def _prune(self, now: float):
+        if len(self._buckets) < 1000:
+            return
+        for user_id in [u for u, b in self._buckets.items() if u not in self._pending and b.idle(now)]:
+            del self._buckets[user_id]
+
+    def acquire(self, user_id: int):
+        """
+        Admits one job for the user; every successful call must be paired
+        with ``release``. Raises UserQueueFull or UserRateLimited otherwise.
+        """
+        if self.is_admin(user_id):
+            return
+        pending = self._pending.get(user_id, 0)
+        if pending >= self.max_pending:
+            self.queue_capped += 1
+            logger.info(f"User {user_id} hit the pending job cap ({pending})")
+            raise UserQueueFull(pending)
+
+        now = time.monotonic()
+        self._prune(now)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        wait = bucket.wait_time(now)
+        if wait > 0:
+            self.rate_limited += 1
+            logger.info(f"User {user_id} rate limited for {wait:.0f}s")
+            raise UserRateLimited(wait)
+        bucket.consume()
+        self._pending[user_id] = pending + 1
+
+    def release(self, user_id: int):
+        if self.is_admin(user_id):
+            return
+        pending = self._pending.get(user_id, 0) - 1
+        if pending > 0:
+            self._pending[user_id] = pending
+        else:
+            self._pending.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._pending),
+            "pending": sum(self._pending.values()),
+            "rate_limited": self.rate_limited,
+            "queue_capped": self.queue_capped,
+        }
@@ -1,105 +1,322 @@
 
+import asyncio
+import json
+import logging
+import multiprocessing
 import os
-from PIL import Image, ImageDraw, ImageFont
-from moviepy.editor import VideoFileClip, TextClip, CompositeVideoClip
+import subprocess
+import sys
+import types
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+# x264 speed/quality trade-off for watermarked videos
+WATERMARK_PRESET = os.getenv("WATERMARK_PRESET", "veryfast")
+WATERMARK_CRF = int(os.getenv("WATERMARK_CRF", "23"))
+# Watermarked JPEGs are re-encoded with these settings; other formats keep their defaults
+WATERMARK_JPEG_QUALITY = int(os.getenv("WATERMARK_JPEG_QUALITY", "90"))
+WATERMARK_JPEG_PROGRESSIVE = os.getenv("WATERMARK_JPEG_PROGRESSIVE", "False").lower() == "true"
+# Audio codecs copied into the watermarked MP4 without re-encoding
+MP4_COPY_AUDIO_CODECS = {"aac", "mp3"}
+
+@lru_cache(maxsize=32)
+def _load_font(font_size):
+    try:
+        return ImageFont.truetype("arial.ttf", font_size)
+    except IOError:
+        try:
+            # Pillow >= 10.1 ships a scalable default font
+            return ImageFont.load_default(size=font_size)
+        except TypeError:
+            return ImageFont.load_default()
+
+
+@lru_cache(maxsize=64)
+def render_watermark_tile(watermark_text, font_size):
+    """
+    Renders the watermark (white text on a semi-transparent black box) as a
+    small RGBA image. Tiles are cached per (text, font size) and shared, so
+    callers must not modify the returned image.
+    """
+    font = _load_font(font_size)
+    left, top, right, bottom = font.getbbox(watermark_text)
+    tile = Image.new('RGBA', (right - left + 10, bottom - top + 10), (0, 0, 0, 128))
+    ImageDraw.Draw(tile).text((5 - left, 5 - top), watermark_text, font=font, fill=(255, 255, 255, 255))
+    return tile
+
 
 def add_watermark_to_image(image_path, watermark_text):
     """
     Adds a text watermark to an image.
     """
     try:
-        image = Image.open(image_path)
-        draw = ImageDraw.Draw(image)
-        
-        # Get image size
+        source = Image.open(image_path)
+        image_format = source.format or "PNG"
+        icc_profile = source.info.get("icc_profile")
+        # Bake in the EXIF orientation so the watermark lands in the visible bottom-right corner.
+        image = ImageOps.exif_transpose(source)
+        source_mode = image.mode
         width, height = image.size
-        
-        # Set font size (adjust as needed)
-        font_size = int(width / 20)
-        
-        # Use a default font or specify a path to a .ttf file
-        try:
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except IOError:
-            font = ImageFont.load_default()
-
-        # Calculate text size and position
-        # Create a separate drawing context to measure text size
-        temp_draw = ImageDraw.Draw(Image.new('RGB', (0, 0)))
-        left, top, right, bottom = temp_draw.textbbox((0, 0), watermark_text, font=font)
-        textwidth = right - left
-        textheight = bottom - top
-        
-        x = width - textwidth - 10
-        y = height - textheight - 10
-        
-        # Add watermark text with a semi-transparent background
-        # Create a transparent overlay
-        overlay = Image.new('RGBA', image.size, (255, 255, 255, 0))
-        draw_overlay = ImageDraw.Draw(overlay)
-        
-        # Define background rectangle position and size
-        rect_x0 = x - 5
-        rect_y0 = y - 5
-        rect_x1 = x + textwidth + 5
-        rect_y1 = y + textheight + 5
-        
-        # Draw the semi-transparent background
-        draw_overlay.rectangle([rect_x0, rect_y0, rect_x1, rect_y1], fill=(0, 0, 0, 128))
-        
-        # Composite the overlay with the original image
-        image = Image.alpha_composite(image.convert('RGBA'), overlay).convert('RGB')
-        
-        # Re-create the draw object for the composited image
-        draw = ImageDraw.Draw(image)
-
-        # Add the text on top of the background
-        draw.text((x, y), watermark_text, font=font, fill=(255, 255, 255))
-        
-        # Save the watermarked image
-        watermarked_path = os.path.splitext(image_path)[0] + "_watermarked.png"
-        image.save(watermarked_path, "PNG")
-        
+        tile = render_watermark_tile(watermark_text, max(1, int(width / 20)))
+
+        # Bottom-right corner, 5px from the edges; clip the tile on tiny images.
+        tile_width, tile_height = min(tile.width, width), min(tile.height, height)
+        if (tile_width, tile_height) != tile.size:
+            tile = tile.crop((0, 0, tile_width, tile_height))
+        x = max(0, width - tile_width - 5)
+        y = max(0, height - tile_height - 5)
+
+        # Only the corner under the tile is composited, not the whole frame.
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha and image_format != "JPEG" else 'RGB')
+            if source_mode not in ('P', 'PA'):
+                # The profile describes the old colour space (CMYK, LAB, grey), not the RGB pixels.
+                icc_profile = None
+        box = (x, y, x + tile_width, y + tile_height)
+        region = image.crop(box).convert('RGBA')
+        region.alpha_composite(tile)
+        image.paste(region if image.mode == 'RGBA' else region.convert(image.mode), box)
+        if source_mode == 'P' and image.mode == 'RGB':
+            # Back to a palette, or the PNG/GIF would grow to full-colour size.
+            image = image.convert('P', palette=Image.Palette.ADAPTIVE, colors=256)
+
+        # Save in the source format so uploads stay close to the original size
+        base, ext = os.path.splitext(image_path)
+        watermarked_path = base + "_watermarked" + ext
+        save_options = {}
+        if icc_profile:
+            save_options["icc_profile"] = icc_profile
+        if image_format == "JPEG":
+            save_options.update(quality=WATERMARK_JPEG_QUALITY, progressive=WATERMARK_JPEG_PROGRESSIVE)
+        image.save(watermarked_path, image_format, **save_options)
+
+        logger.info(
+            f"Watermarked {os.path.basename(image_path)} ({image_format}): "
+            f"{os.path.getsize(image_path)} -> {os.path.getsize(watermarked_path)} bytes"
+        )
         return watermarked_path
     except Exception as e:
-        print(f"Error adding watermark to image: {e}")
+        logger.error(f"Error adding watermark to image: {e}")
         return None
 
-def add_watermark_to_video(video_path, watermark_text):
+
+def probe_video(video_path):
+    """Returns (width, height, duration_seconds) of a video using ffprobe; unknown values are None."""
+    result = subprocess.run(
+        [
+            FFPROBE_BINARY, "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "stream=width,height:format=duration",
+            "-of", "json", video_path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    info = json.loads(result.stdout or "{}")
+    stream = (info.get("streams") or [{}])[0]
+    duration = info.get("format", {}).get("duration")
+    return stream.get("width"), stream.get("height"), float(duration) if duration else None
+
+
+def probe_codecs(video_path):
+    """Returns (video_codec, audio_codec) of a file's first streams using ffprobe; a missing stream is None."""
+    result = subprocess.run(
+        [
+            FFPROBE_BINARY, "-v", "error",
+            "-show_entries", "stream=codec_type,codec_name",
+            "-of", "json", video_path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    codecs = {}
+    for stream in json.loads(result.stdout or "{}").get("streams") or []:
+        codecs.setdefault(stream.get("codec_type"), stream.get("codec_name"))
+    return codecs.get("video"), codecs.get("audio")
+
+
+def _prepare_video_job(video_path, watermark_text):
     """
-    Adds a text watermark to a video.
+    Probes the video and renders its watermark tile.
+    Returns (ffmpeg_command, watermarked_path, tile_path, duration_seconds).
     """
+    base = os.path.splitext(video_path)[0]
+    watermarked_path = base + "_watermarked.mp4"
+    tile_path = base + "_watermark_tile.png"
     try:
-        video_clip = VideoFileClip(video_path)
-        
-        # Create a text clip for the watermark
-        txt_clip = TextClip(watermark_text, fontsize=50, color='white', bg_color='black')
-        
-        # Position the text clip at the bottom right
-        txt_clip = txt_clip.set_position(('right', 'bottom')).set_duration(video_clip.duration)
-        
-        # Composite the video clip with the text clip
-        video = CompositeVideoClip([video_clip, txt_clip])
-        
-        # Write the result to a new file
-        watermarked_path = os.path.splitext(video_path)[0] + "_watermarked.mp4"
-        video.write_videofile(watermarked_path, codec="libx264")
-        
-        return watermarked_path
+        width, height, duration = probe_video(video_path)
     except Exception as e:
-        print(f"Error adding watermark to video: {e}")
-        return None
+        # Still watermark, just without progress and with a default font size.
+        logger.warning(f"ffprobe failed for {video_path}: {e}")
+        width, height, duration = None, None, None
+    try:
+        _, audio_codec = probe_codecs(video_path)
+    except Exception as e:
+        logger.warning(f"ffprobe failed for {video_path}: {e}")
+        audio_codec = None
+    # MP4 takes AAC and MP3 as they are; anything else (Opus, Vorbis, ...) is re-encoded.
+    audio_args = ["-c:a", "copy"] if audio_codec in MP4_COPY_AUDIO_CODECS else ["-c:a", "aac", "-b:a", "128k"]
+    font_size = max(16, int((width or 1000) / 20))
+    render_watermark_tile(watermark_text, font_size).save(tile_path, "PNG")
 
-async def apply_watermark(file_path, watermark_text):
+    command = [
+        FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+        "-nostats", "-progress", "pipe:1",
+        "-i", video_path,
+        "-i", tile_path,
+        "-filter_complex", "[0:v:0][1:v]overlay=W-w-10:H-h-10:format=auto,format=yuv420p[v]",
+        "-map", "[v]", "-map", "0:a?",
+        "-c:v", "libx264", "-preset", WATERMARK_PRESET, "-crf", str(WATERMARK_CRF),
+        *audio_args,
+        # Index first, so the upload streams without a separate remux.
+        "-movflags", "+faststart",
+        watermarked_path,
+    ]
+    return command, watermarked_path, tile_path, duration
+
+
+def _report_progress(line, duration, progress_callback):
+    # -progress emits key=value lines; out_time_us is the encoded position.
+    key, _, value = line.strip().partition("=")
+    if key == "out_time_us" and progress_callback and duration and value.isdigit():
+        progress_callback(min(int(value) / 1_000_000, duration), duration)
+
+
+def _remove_quietly(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv', '.webm']
+
+
+class WatermarkQueueFull(Exception):
+    """Raised when too many watermark jobs are already running or waiting."""
+
+
+@contextmanager
+def _without_main_module():
+    """
+    Hides the entry script from multiprocessing while worker processes start.
+    Otherwise every worker re-imports it as __mp_main__, with the whole bot
+    and its side effects; the image workers only need this module.
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class WatermarkPool:
     """
-    Applies a watermark to an image or video file.
+    Runs watermark jobs off the event loop.
+
+    Images are watermarked in a process pool, so Pillow work scales across
+    cores instead of contending for the GIL. Videos are encoded by an ffmpeg
+    subprocess driven with asyncio, so no thread is tied up per video and a
+    timed-out or cancelled job is stopped by killing ffmpeg. At most
+    ``workers`` jobs run at once; beyond ``max_queued`` waiting jobs new ones
+    are rejected with WatermarkQueueFull.
     """
-    file_ext = os.path.splitext(file_path)[1].lower()
-    
-    if file_ext in ['.jpg', '.jpeg', '.png']:
-        return add_watermark_to_image(file_path, watermark_text)
-    elif file_ext in ['.mp4', '.avi', '.mov', '.mkv']:
-        return add_watermark_to_video(file_path, watermark_text)
-    else:
-        # Unsupported file type
-        return file_path
+
+    def __init__(self, workers=None, max_queued=20, timeout=600.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(self.workers)
+        self._pending = 0
+        self._executor = None
+
+    def _image_executor(self):
+        if self._executor is None:
+            # forkserver: forking a process that runs the bot's threads can deadlock
+            # the child, so workers fork from a clean server that has this module
+            # (and Pillow) loaded already.
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    async def apply(self, file_path, watermark_text, progress_callback=None):
+        """
+        Watermarks a file and returns the new path, the original path for
+        unsupported types, or None if watermarking failed or timed out.
+        """
+        if self._pending >= self.workers + self.max_queued:
+            raise WatermarkQueueFull(f"Watermark queue is full ({self.max_queued} waiting)")
+        self._pending += 1
+        try:
+            async with self._slots:
+                file_ext = os.path.splitext(file_path)[1].lower()
+                if file_ext in IMAGE_EXTENSIONS:
+                    job = self._run_image(file_path, watermark_text)
+                elif file_ext in VIDEO_EXTENSIONS:
+                    job = self._run_video(file_path, watermark_text, progress_callback)
+                else:
+                    return file_path
+                try:
+                    return await asyncio.wait_for(job, timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    logger.error(f"Watermarking {file_path} timed out after {self.timeout:.0f}s")
+                    return None
+        finally:
+            self._pending -= 1
+
+    async def _run_image(self, image_path, watermark_text):
+        loop = asyncio.get_running_loop()
+        executor = self._image_executor()
+        # Submitting starts a worker when none is idle; keep the bot out of it.
+        with _without_main_module():
+            future = loop.run_in_executor(executor, add_watermark_to_image, image_path, watermark_text)
+        return await future
+
+    async def _run_video(self, video_path, watermark_text, progress_callback):
+        watermarked_path = tile_path = None
+        process = None
+        succeeded = False
+        try:
+            command, watermarked_path, tile_path, duration = await asyncio.to_thread(
+                _prepare_video_job, video_path, watermark_text
+            )
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            # Drain stderr alongside stdout so ffmpeg never blocks on a full pipe.
+            stderr_task = asyncio.create_task(process.stderr.read())
+            async for line in process.stdout:
+                _report_progress(line.decode(errors="replace"), duration, progress_callback)
+            stderr = (await stderr_task).decode(errors="replace")
+            if await process.wait() != 0:
+                raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {stderr.strip()[-500:]}")
+            if progress_callback and duration:
+                progress_callback(duration, duration)
+            succeeded = True
+            return watermarked_path
+        except Exception as e:
+            logger.error(f"Error adding watermark to video: {e}")
+            return None
+        finally:
+            # Also reached on timeout/cancellation: stop ffmpeg before removing its output.
+            if process is not None and process.returncode is None:
+                process.kill()
+                await process.wait()
+            if not succeeded:
+                _remove_quietly(watermarked_path)
+            _remove_quietly(tile_path)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None